@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+
+import commodity_prices
+import db
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parsed = parser.parse_args()
+
+    writer = db.BulkWriter(batch_size=parsed.batch_size)
+    markets = db.market.find(
+        {},
+        {
+            "_id": 0,
+            "system": 1,
+            "station": 1,
+            "update_time": 1,
+            "commodities": 1,
+            "source": 1,
+        },
+    )
+    for (i, market) in enumerate(markets, 1):
+        for operation in commodity_prices.operations(
+            market["system"],
+            market["station"],
+            market.get("update_time"),
+            market.get("commodities", []),
+            market.get("source"),
+        ):
+            writer.add(db.commodity_prices, operation)
+        if i % parsed.batch_size == 0:
+            print(f"Queued prices for {i} markets")
+    writer.flush()
+
+    db.dump_meta.update_one(
+        commodity_prices.backfilled_marker,
+        {"$set": commodity_prices.backfilled_marker},
+        upsert=True,
+    )
+    print("Backfill complete, /sales will now use db.commodity_prices")
+
+
+if __name__ == "__main__":
+    main()
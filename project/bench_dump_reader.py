@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+
+import json
+import resource
+import subprocess
+import time
+
+from dump_reader import read_dump
+
+
+def read_with_jq(path):
+    """The old subprocess pipeline, kept here for comparison."""
+    cmd = (
+        f"zcat '{path}' | "
+        f"jq -nc --stream 'fromstream(1|truncate_stream(inputs))'"
+    )
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True)
+    for line in p.stdout:
+        yield json.loads(line)
+    p.wait()
+
+
+def read_in_process(path):
+    for (_, item) in read_dump(path):
+        yield item
+
+
+def bench(name, items):
+    start = time.perf_counter()
+    count = sum(1 for _ in items)
+    elapsed = time.perf_counter() - start
+    return {
+        "reader": name,
+        "items": count,
+        "seconds": round(elapsed, 3),
+        "items_per_second": round(count / elapsed) if elapsed else None,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "max_child_rss_kb": (
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        ),
+    }
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dump", help="Local copy of a gzipped dump")
+    parser.add_argument("--skip-jq", action="store_true")
+    parsed = parser.parse_args()
+
+    results = [bench("in-process", read_in_process(parsed.dump))]
+    if not parsed.skip_jq:
+        results.append(bench("jq", read_with_jq(parsed.dump)))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
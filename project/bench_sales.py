@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+
+
+import datetime
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from collections import Counter
+
+import pymongo
+from pymongo import monitoring
+
+from coalescing_writer import percentiles
+
+
+station_types = [
+    ("Coriolis Starport", 3),
+    ("Orbis Starport", 1),
+    ("Outpost", 3),
+    ("Planetary Outpost", 2),
+    ("Fleet Carrier", 4),
+    ("Odyssey Settlement", 3),
+]
+
+# Commodities worth hauling, by EDSM id, with a realistic base price; the
+# rest of each market is filled out with cheaper synthetic ones
+valuable_commodities = {
+    "painite": ("Painite", 600000),
+    "lowtemperaturediamond": ("Low Temperature Diamonds", 700000),
+    "opal": ("Void Opal", 800000),
+    "platinum": ("Platinum", 300000),
+    "palladium": ("Palladium", 60000),
+    "gold": ("Gold", 50000),
+    "osmium": ("Osmium", 40000),
+    "tritium": ("Tritium", 50000),
+    "bertrandite": ("Bertrandite", 20000),
+    "silver": ("Silver", 40000),
+}
+
+
+class RoundTrips(monitoring.CommandListener):
+    """Commands sent to Mongo, by command name."""
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def started(self, event):
+        self.counts[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def count_mongomock_calls(round_trips):
+    """mongomock has no command monitoring, so count collection calls."""
+    import mongomock
+
+    # mongomock implements some calls with others; only count the outermost
+    depth = threading.local()
+    for name in (
+        "find",
+        "find_one",
+        "aggregate",
+        "distinct",
+        "bulk_write",
+        "update_one",
+        "insert_one",
+    ):
+        original = getattr(mongomock.collection.Collection, name)
+
+        def counted(self, *args, _original=original, _name=name, **kwargs):
+            if not getattr(depth, "value", 0):
+                round_trips.counts[_name] += 1
+            depth.value = getattr(depth, "value", 0) + 1
+            try:
+                return _original(self, *args, **kwargs)
+            finally:
+                depth.value -= 1
+
+        setattr(mongomock.collection.Collection, name, counted)
+
+
+def synthetic_galaxy(systems=2000, extent=150, commodities=120, seed=0):
+    """System coordinates and EDSM station dump entries for a fake galaxy.
+
+    Systems are spread uniformly over a cube `2 * extent` ly on a side, and
+    about half of them get stations.  Every market lists a random subset of
+    `commodities` commodities, the way EDSM dump entries do.
+    """
+    rng = random.Random(seed)
+    catalog = dict(valuable_commodities)
+    for i in range(len(catalog), commodities):
+        catalog[f"synthetic{i}"] = (f"Synthetic {i}", rng.randint(100, 10000))
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    (types, weights) = zip(*station_types)
+    system_docs = []
+    entries = []
+    for i in range(systems):
+        name = f"Synthetic {i}"
+        system_docs.append({
+            "name": name,
+            "id64": i,
+            "coords": {
+                "x": rng.uniform(-extent, extent),
+                "y": rng.uniform(-extent, extent),
+                "z": rng.uniform(-extent, extent),
+            },
+        })
+        if rng.random() < 0.5:
+            continue
+        for j in range(rng.randint(1, 4)):
+            updated = now - datetime.timedelta(
+                seconds=rng.randint(0, 30 * 24 * 3600),
+            )
+            listed = rng.sample(
+                sorted(catalog),
+                rng.randint(len(catalog) // 4, 3 * len(catalog) // 4),
+            )
+            entries.append({
+                "systemName": name,
+                "name": f"{name} Station {j}",
+                "marketId": i * 10 + j,
+                "type": rng.choices(types, weights)[0],
+                "distanceToArrival": rng.randint(5, 50000),
+                "updateTime": {
+                    "market": updated.strftime("%Y-%m-%d %H:%M:%S"),
+                },
+                "commodities": [
+                    {
+                        "id": c,
+                        "name": catalog[c][0],
+                        "sellPrice": int(
+                            catalog[c][1] * rng.uniform(0.6, 1.4)
+                        ),
+                        "buyPrice": 0,
+                        "stock": 0,
+                        # Most markets only want a little of anything
+                        "demand": int(rng.paretovariate(1.2) * 100) - 100,
+                    }
+                    for c in listed
+                ],
+            })
+    return (system_docs, entries)
+
+
+def load(system_docs, entries, price_index=False):
+    """Insert the synthetic galaxy the way the dump loaders would store it."""
+    import commodity_prices
+    import db
+    from conversion import from_edsm
+
+    markets = []
+    stations = []
+    prices = []
+    readable = {}
+    for entry in entries:
+        converted = from_edsm(entry)
+        for c in converted["commodities"]:
+            readable[c["name"]] = c.pop("readable")
+        key = {"system": converted["system"], "station": converted["station"]}
+        stations.append({
+            **key,
+            "type": converted["type"],
+            "sc_distance": converted["sc_distance"],
+            "source": "edsm-dump",
+        })
+        markets.append({
+            **key,
+            "update_time": converted["update_time"],
+            "commodities": converted["commodities"],
+            "source": "edsm-dump",
+        })
+        if price_index:
+            prices.extend(
+                {
+                    "name": c["name"],
+                    **key,
+                    "sellPrice": c["sellPrice"],
+                    "demand": c["demand"],
+                    "update_time": converted["update_time"],
+                    "source": "edsm-dump",
+                }
+                for c in converted["commodities"]
+            )
+
+    db.systems.insert_many(system_docs)
+    db.station.insert_many(stations)
+    db.market.insert_many(markets)
+    db.commodity.insert_many(
+        [{"name": name, "readable": r} for (name, r) in readable.items()]
+    )
+    if prices:
+        db.commodity_prices.insert_many(prices)
+        db.dump_meta.insert_one(commodity_prices.backfilled_marker)
+    return {
+        "systems": len(system_docs),
+        "markets": len(markets),
+        "commodity_prices": len(prices),
+    }
+
+
+def stub_edsm(system_docs):
+    """Answer EDSM sphere queries from the synthetic galaxy instead."""
+    import edsm
+    import edsm_async
+    import galaxy
+    import main as api
+
+    index = galaxy.GalaxyIndex(system_docs)
+
+    def systems_in_sphere_raw(location, radius=30, min_radius=0):
+        return index.sphere(location, radius=radius, min_radius=min_radius)
+
+    async def systems_in_sphere_raw_async(location, radius=30, min_radius=0):
+        return systems_in_sphere_raw(location, radius, min_radius)
+
+    edsm.systems_in_sphere_raw = systems_in_sphere_raw
+    api.systems_in_sphere_raw = systems_in_sphere_raw
+    edsm_async.systems_in_sphere_raw = systems_in_sphere_raw_async
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(
+    client,
+    round_trips,
+    system_docs,
+    path,
+    radius,
+    cargo_size,
+    repeats,
+    min_price,
+    rng,
+):
+    """Time `repeats` /sales requests from random systems with random cargo."""
+    import db
+
+    names = db.commodity.distinct("name")
+    latencies = []
+    trips = []
+    by_command = Counter()
+    results = 0
+    for _ in range(repeats):
+        request = {
+            "system": rng.choice(system_docs)["name"],
+            "radius": radius,
+            "cargo": {
+                name: rng.randint(1, 700)
+                for name in rng.sample(names, min(cargo_size, len(names)))
+            },
+            "min_price": min_price,
+            "server_side": path == "server",
+        }
+        round_trips.counts.clear()
+        start = time.perf_counter()
+        response = client.post("/sales", json=request)
+        elapsed = time.perf_counter() - start
+        response.raise_for_status()
+        latencies.append(round(elapsed * 1000, 3))
+        trips.append(sum(round_trips.counts.values()))
+        by_command.update(round_trips.counts)
+        results += len(response.json())
+
+    latency = percentiles(latencies, points=(50, 99))
+    return {
+        "path": path,
+        "radius": radius,
+        "cargo_size": cargo_size,
+        "requests": repeats,
+        "p50_ms": latency["p50"],
+        "p99_ms": latency["p99"],
+        "mean_round_trips": round(sum(trips) / repeats, 2),
+        "round_trips_by_command": {
+            name: round(count / repeats, 2)
+            for (name, count) in sorted(by_command.items())
+        },
+        "mean_results": round(results / repeats, 2),
+    }
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--mongomock",
+        action="store_true",
+        help="Use an in-memory mongomock instead of MONGO_URL",
+    )
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="Drop an existing market collection before loading",
+    )
+    parser.add_argument("--systems", type=int, default=2000)
+    parser.add_argument("--extent", type=float, default=150)
+    parser.add_argument("--commodities", type=int, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--radii",
+        type=float,
+        nargs="+",
+        default=[10, 25, 50, 75, 100],
+    )
+    parser.add_argument(
+        "--cargo-sizes",
+        type=int,
+        nargs="+",
+        default=[1, 5, 10, 20, 30],
+    )
+    parser.add_argument(
+        "--paths",
+        nargs="+",
+        choices=["server", "python", "snapshot"],
+        default=["server", "python", "snapshot"],
+    )
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--min-price", type=int, default=1)
+    parser.add_argument(
+        "--price-index",
+        action="store_true",
+        help="Also load db.commodity_prices, as after a backfill",
+    )
+    parser.add_argument(
+        "--result-cache",
+        action="store_true",
+        help="Leave the /sales result cache on",
+    )
+    parser.add_argument("--output", default=None)
+    parsed = parser.parse_args()
+
+    # Both have to happen before db creates its client
+    round_trips = RoundTrips()
+    if parsed.mongomock:
+        import mongomock
+        pymongo.MongoClient = mongomock.MongoClient
+        count_mongomock_calls(round_trips)
+        if "server" in parsed.paths:
+            print("mongomock can't run the /sales pipeline, skipping server")
+            parsed.paths.remove("server")
+    else:
+        monitoring.register(round_trips)
+
+    from fastapi.testclient import TestClient
+
+    import commodity_prices
+    import db
+    import main as api
+    import market_snapshot
+
+    if db.market.estimated_document_count():
+        if not parsed.drop:
+            parser.error(
+                f"{db.market.full_name} isn't empty; point MONGO_URL at a "
+                f"scratch mongod or pass --drop"
+            )
+        for collection in (
+            db.market,
+            db.station,
+            db.commodity,
+            db.systems,
+            db.commodity_prices,
+            db.system_versions,
+        ):
+            collection.drop()
+        db.dump_meta.delete_one(commodity_prices.backfilled_marker)
+
+    start = time.perf_counter()
+    (system_docs, entries) = synthetic_galaxy(
+        systems=parsed.systems,
+        extent=parsed.extent,
+        commodities=parsed.commodities,
+        seed=parsed.seed,
+    )
+    loaded = load(system_docs, entries, price_index=parsed.price_index)
+    print(f"Loaded {loaded} in {time.perf_counter() - start:.1f}s")
+    stub_edsm(system_docs)
+    if not parsed.result_cache:
+        api.results.max_entries = 0
+
+    rng = random.Random(parsed.seed)
+    results = []
+    with TestClient(api.app) as client:
+        for path in parsed.paths:
+            market_snapshot.enabled = path == "snapshot"
+            if path == "snapshot":
+                market_snapshot.snapshot.load()
+            for radius in parsed.radii:
+                for cargo_size in parsed.cargo_sizes:
+                    result = run(
+                        client,
+                        round_trips,
+                        system_docs,
+                        path,
+                        radius,
+                        cargo_size,
+                        parsed.repeats,
+                        parsed.min_price,
+                        rng,
+                    )
+                    print(json.dumps(result))
+                    results.append(result)
+
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "ran_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "backend": "mongomock" if parsed.mongomock else "mongod",
+        "parameters": {
+            k: v for (k, v) in vars(parsed).items()
+            if k not in ("output", "drop")
+        },
+        "loaded": loaded,
+        "results": results,
+    }
+    output = parsed.output or f"bench-sales-{commit or 'unknown'}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
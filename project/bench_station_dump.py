@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+
+import datetime
+import gzip
+import json
+import time
+
+import bench_sales
+
+
+def write_dump(entries, path):
+    """Write `entries` the way EDSM lays out its dumps, one per line."""
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write("[\n")
+        f.write(",\n".join(json.dumps(entry) for entry in entries))
+        f.write("\n]\n")
+
+
+def _drop():
+    import db
+    for collection in (
+        db.market,
+        db.station,
+        db.commodity,
+        db.commodity_prices,
+        db.system_versions,
+    ):
+        collection.drop()
+
+
+def run(path, entries, workers, writers, lines):
+    """Load the dump into empty collections and time it."""
+    import parallel_dump
+    import station_dump
+    from dump_reader import read_dump
+
+    _drop()
+    start = time.perf_counter()
+    if workers:
+        counts = parallel_dump.load(
+            path,
+            workers=workers,
+            writers=writers or workers,
+            lines=lines,
+        )
+    else:
+        counts = station_dump.load_dump(read_dump(path))
+    elapsed = time.perf_counter() - start
+    return {
+        "workers": workers or "serial",
+        "writers": (writers or workers) if workers else None,
+        "entries": entries,
+        "changed": counts["changed"],
+        "seconds": round(elapsed, 3),
+        "entries_per_second": round(entries / elapsed, 1),
+    }
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="Drop existing dump collections before each load",
+    )
+    parser.add_argument("--systems", type=int, default=20000)
+    parser.add_argument("--commodities", type=int, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="Worker counts to try; 0 is the single-process loader",
+    )
+    parser.add_argument(
+        "--writers",
+        type=int,
+        default=None,
+        help="Writer processes (default: as many as workers)",
+    )
+    parser.add_argument("--lines", type=int, default=1000)
+    parser.add_argument("--dump", default="bench-stations.json.gz")
+    parser.add_argument("--output", default=None)
+    parsed = parser.parse_args()
+
+    import db
+
+    if db.market.estimated_document_count() and not parsed.drop:
+        parser.error(
+            f"{db.market.full_name} isn't empty; point MONGO_URL at a "
+            f"scratch mongod or pass --drop"
+        )
+
+    (_, entries) = bench_sales.synthetic_galaxy(
+        systems=parsed.systems,
+        commodities=parsed.commodities,
+        seed=parsed.seed,
+    )
+    write_dump(entries, parsed.dump)
+    print(f"Wrote {len(entries)} stations to {parsed.dump}")
+
+    results = []
+    for workers in parsed.workers:
+        result = run(
+            parsed.dump,
+            len(entries),
+            workers,
+            parsed.writers,
+            parsed.lines,
+        )
+        results.append(result)
+    # Speedup over the first configuration tried
+    baseline = results[0]["entries_per_second"] if results else None
+    for result in results:
+        result["speedup"] = round(result["entries_per_second"] / baseline, 2)
+        print(json.dumps(result))
+
+    commit = bench_sales._git_commit()
+    report = {
+        "commit": commit,
+        "ran_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "parameters": {
+            k: v for (k, v) in vars(parsed).items()
+            if k not in ("output", "drop")
+        },
+        "results": results,
+    }
+    output = parsed.output or f"bench-station-dump-{commit or 'unknown'}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import queue
+import threading
+import time
+from collections import Counter
+from collections import deque
+
+import ingest_metrics
+
+
+def percentiles(values, points=(50, 90, 99)):
+    ordered = sorted(values)
+    if not ordered:
+        return {f"p{p}": None for p in points}
+    return {
+        f"p{p}": ordered[min(len(ordered) - 1, len(ordered) * p // 100)]
+        for p in points
+    }
+
+
+class CoalescingWriter:
+    """Persist updates from a background thread, in coalesced bulk writes.
+
+    `submit` never blocks: updates go on a bounded queue and are dropped
+    (and counted) if it is full.  The writer thread keeps only the newest
+    update per key, and flushes every `flush_messages` updates or every
+    `flush_ms` milliseconds, whichever comes first.
+    """
+
+    def __init__(self, queue_size=10000, flush_messages=500, flush_ms=1000):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.flush_messages = flush_messages
+        self.flush_seconds = flush_ms / 1000
+        self.received = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.written = 0
+        self.flushes = 0
+        self.errors = 0
+        self.skipped = 0
+        # (collection, key) of updates whose last write failed
+        self._failed = set()
+        # Milliseconds taken by recent bulk writes
+        self.write_ms = deque(maxlen=1000)
+        # Milliseconds from submitting the oldest update in each recent
+        # flush to that flush being written
+        self.lag_ms = deque(maxlen=1000)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def submit(
+        self,
+        collection,
+        key,
+        timestamp,
+        operation,
+        label="",
+        after=None,
+    ):
+        """Queue `operation` on `collection`, superseding older ones for `key`.
+
+        `operation` may also be a list of operations to supersede together.
+        `label` names where the update came from in the ingest metrics.
+        `after` is a `(collection, key)` submitted earlier that this update
+        depends on; it is skipped if that write fails.
+
+        Returns False if the queue is full and the update was dropped.
+        """
+        self.received += 1
+        try:
+            self.queue.put_nowait((
+                collection,
+                key,
+                timestamp,
+                operation,
+                label,
+                None if after is None else (after[0].full_name, after[1]),
+                time.monotonic(),
+            ))
+        except queue.Full:
+            self.dropped += 1
+            ingest_metrics.writer_dropped.labels(label).inc()
+            return False
+        return True
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "received": self.received,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "written": self.written,
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "write_ms": percentiles(list(self.write_ms)),
+            "lag_ms": percentiles(list(self.lag_ms)),
+        }
+
+    def _write(self, by_collection):
+        for (collection, keys, ops, labels) in by_collection.values():
+            try:
+                start = time.perf_counter()
+                collection.bulk_write(ops, ordered=False)
+                elapsed = time.perf_counter() - start
+                self.write_ms.append(round(elapsed * 1000, 3))
+                self.written += len(ops)
+                ingest_metrics.observe_bulk_write(collection, labels, elapsed)
+                self._failed.difference_update(keys)
+            except Exception as e:
+                self.errors += 1
+                ingest_metrics.bulk_write_errors.labels(collection.name).inc()
+                print(f"Bulk write of {len(ops)} to {collection.full_name} failed: {e}")
+                self._failed.update(keys)
+
+    def _flush(self, pending, oldest):
+        # Updates depending on others are written once those have been
+        for dependent in (False, True):
+            by_collection = {}
+            for (full_key, entry) in pending.items():
+                (collection, _, operation, label, after) = entry
+                if bool(after) != dependent:
+                    continue
+                if after and after <= self._failed:
+                    self.skipped += 1
+                    continue
+                (_, keys, ops, labels) = by_collection.setdefault(
+                    collection.full_name,
+                    (collection, [], [], Counter()),
+                )
+                keys.append(full_key)
+                if isinstance(operation, list):
+                    ops.extend(operation)
+                    labels[label] += len(operation)
+                else:
+                    ops.append(operation)
+                    labels[label] += 1
+            self._write(by_collection)
+        self.lag_ms.append(round((time.monotonic() - oldest) * 1000, 3))
+        self.flushes += 1
+
+    def _run(self):
+        pending = {}
+        count = 0
+        oldest = None
+        deadline = time.monotonic() + self.flush_seconds
+        while not (self._stop.is_set() and self.queue.empty()):
+            try:
+                item = self.queue.get(
+                    timeout=max(0, deadline - time.monotonic()),
+                )
+            except queue.Empty:
+                pass
+            else:
+                (
+                    collection,
+                    key,
+                    timestamp,
+                    operation,
+                    label,
+                    after,
+                    submitted,
+                ) = item
+                if oldest is None:
+                    oldest = submitted
+                full_key = (collection.full_name, key)
+                # Coalesced updates depend on everything any of them did
+                after = frozenset() if after is None else frozenset([after])
+                current = pending.get(full_key)
+                if current is not None:
+                    self.coalesced += 1
+                    after |= current[4]
+                if current is None or current[1] <= timestamp:
+                    pending[full_key] = (
+                        collection,
+                        timestamp,
+                        operation,
+                        label,
+                        after,
+                    )
+                elif after:
+                    pending[full_key] = current[:4] + (after,)
+                count += 1
+
+            if count >= self.flush_messages or time.monotonic() >= deadline:
+                if pending:
+                    self._flush(pending, oldest)
+                pending = {}
+                count = 0
+                oldest = None
+                deadline = time.monotonic() + self.flush_seconds
+
+        if pending:
+            self._flush(pending, oldest)
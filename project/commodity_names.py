@@ -0,0 +1,75 @@
+import os
+import time
+
+import db
+
+
+# How often we check whether the dump loader has added commodities
+reload_seconds = float(os.environ.get("COMMODITY_RELOAD_SECONDS", 60))
+
+# Bumped in dump_meta by station_dump whenever it writes new commodities
+updated_marker = {"operation": "commodities"}
+
+# Player shorthand for commodity names, matched case-insensitively
+aliases = {
+    "ltd": "lowtemperaturediamond",
+    "ltds": "lowtemperaturediamond",
+    "low temp diamonds": "lowtemperaturediamond",
+    "vo": "opal",
+    "vos": "opal",
+    "void opals": "opal",
+}
+
+
+class CommodityNames:
+    """In-process readable name -> internal name table.
+
+    Readable names, internal names and `aliases` are all matched
+    case-insensitively.  The table is reloaded when the dump loader reports
+    new commodities; names it still doesn't know fall back to an indexed
+    lookup in db.commodity.
+    """
+
+    def __init__(self):
+        self.names = None
+        self.version = None
+        self.checked_at = None
+
+    def load(self):
+        names = {}
+        for c in db.commodity.find({}, {"_id": 0, "name": 1, "readable": 1}):
+            names[c["name"].lower()] = c["name"]
+            if c.get("readable"):
+                names[c["readable"].lower()] = c["name"]
+        names.update(aliases)
+        self.names = names
+        print(f"Loaded {len(names)} commodity names")
+
+    def refresh(self):
+        now = time.time()
+        fresh = (
+            self.checked_at is not None and
+            now - self.checked_at < reload_seconds
+        )
+        if fresh:
+            return
+        marker = db.dump_meta.find_one(updated_marker) or {}
+        version = marker.get("version")
+        if self.names is None or version != self.version:
+            self.load()
+            self.version = version
+        self.checked_at = now
+
+    def translate(self, readable):
+        self.refresh()
+        key = readable.strip().lower()
+        name = self.names.get(key)
+        if name is None:
+            entry = db.commodity.find_one({"readable": readable}, {"name": 1})
+            name = entry["name"] if entry else readable
+            # Remember misses too; the next reload starts from scratch
+            self.names[key] = name
+        return name
+
+
+translations = CommodityNames()
@@ -0,0 +1,105 @@
+from pymongo import DeleteMany
+from pymongo import UpdateOne
+
+import db
+
+
+# Set in dump_meta once every market has rows in db.commodity_prices; until
+# then the rows can't be trusted to rule markets out
+backfilled_marker = {"operation": "commodity_prices", "backfilled": True}
+
+
+def operations(system, station, update_time, commodities, source):
+    """Writes bringing a market's rows in db.commodity_prices up to date.
+
+    The dump never overwrites rows the (fresher) EDDN feed wrote, the same
+    way it treats markets, and loaders skip markets EDDN owns altogether.
+    EDDN only ever writes its own rows, and takes the market over by
+    dropping any rows from other sources.  The two never match the same
+    row, so neither upserts a duplicate of the other's.
+    """
+    names = [c["name"] for c in commodities]
+    if source == "eddn":
+        guard = {"source": "eddn"}
+        # Drop commodities the market no longer lists, and the dump's rows
+        stale = {
+            "$or": [
+                {"name": {"$nin": names}},
+                {"source": {"$ne": "eddn"}},
+            ],
+        }
+    else:
+        guard = {"source": {"$ne": "eddn"}}
+        # Drop commodities the market no longer lists
+        stale = {"name": {"$nin": names}, **guard}
+
+    ops = [
+        DeleteMany({"system": system, "station": station, **stale}),
+    ]
+    ops.extend(
+        UpdateOne(
+            {"name": c["name"], "system": system, "station": station, **guard},
+            {
+                "$set": {
+                    "name": c["name"],
+                    "system": system,
+                    "station": station,
+                    "sellPrice": c["sellPrice"],
+                    "demand": c["demand"],
+                    "update_time": update_time,
+                    "source": source,
+                },
+            },
+            upsert=True,
+        )
+        for c in commodities
+    )
+    return ops
+
+
+_backfilled = False
+
+
+def is_backfilled():
+    global _backfilled
+    if not _backfilled:
+        _backfilled = db.dump_meta.find_one(backfilled_marker) is not None
+    return _backfilled
+
+
+def candidate_query(
+    commodities,
+    system_names,
+    min_price=1,
+    min_demand=1,
+    updated_after=None,
+):
+    query = {
+        "name": {"$in": list(commodities)},
+        "system": {"$in": list(system_names)},
+        "sellPrice": {"$gte": min_price},
+        "demand": {"$gte": min_demand},
+    }
+    if updated_after is not None:
+        query["update_time"] = {"$gt": updated_after}
+    return query
+
+
+def candidate_systems(
+    commodities,
+    system_names,
+    min_price=1,
+    min_demand=1,
+    updated_after=None,
+):
+    """Systems with a market buying any of `commodities` above the floors."""
+    return db.commodity_prices.distinct(
+        "system",
+        candidate_query(
+            commodities,
+            system_names,
+            min_price=min_price,
+            min_demand=min_demand,
+            updated_after=updated_after,
+        ),
+    )
@@ -2,25 +2,55 @@ import datetime
 from cytoolz import get_in
 
 
-def from_eddn(entry):
-    def g(path):
-        return get_in(path, entry, default=None)
+# Journal StationType values, named the way EDSM (and so our station
+# collection) names them
+journal_station_types = {
+    "Coriolis": "Coriolis Starport",
+    "Orbis": "Orbis Starport",
+    "Ocellus": "Ocellus Starport",
+    "Bernal": "Ocellus Starport",
+    "Outpost": "Outpost",
+    "CraterOutpost": "Planetary Outpost",
+    "CraterPort": "Planetary Port",
+    "AsteroidBase": "Asteroid base",
+    "MegaShip": "Mega ship",
+    "FleetCarrier": "Fleet Carrier",
+    "OnFootSettlement": "Odyssey Settlement",
+}
 
-    market_id = g(["message", "marketId"])
-    system = g(["message", "systemName"])
-    station = g(["message", "stationName"])
-    update_time_raw = g(["header", "gatewayTimestamp"])
-    # EDDN uses ISO format, which is what we'll use at rest.  We don't get
-    # microsecond precision out of EDSM though, so we will truncate the EDDN
-    # microseconds.
-    update_time_dt = datetime.datetime.strptime(
+# Ships that can only land on a large pad
+large_ships = {
+    "anaconda",
+    "belugaliner",
+    "cutter",
+    "federation_corvette",
+    "type9",
+    "type9_military",
+    "panthermkii",
+}
+
+
+def _eddn_time(entry):
+    update_time_raw = get_in(["header", "gatewayTimestamp"], entry)
+    # EDDN uses ISO format.  At rest we store a native (UTC) datetime so the
+    # freshness of a market can be range-queried on an index.
+    return datetime.datetime.strptime(
         # EDDN entries already have the Z for UTC, but strptime only knows how
         # to make timezone-aware datetimes if you use the +00:00 designation
         # and capture with %z
         update_time_raw + " +00:00",
         "%Y-%m-%dT%H:%M:%S.%fZ %z",
     )
-    update_time = update_time_dt.isoformat()
+
+
+def from_eddn(entry):
+    def g(path):
+        return get_in(path, entry, default=None)
+
+    market_id = g(["message", "marketId"])
+    system = g(["message", "systemName"])
+    station = g(["message", "stationName"])
+    update_time = _eddn_time(entry)
     commodities = [
         {
             "name": com["name"],
@@ -41,6 +71,95 @@ def from_eddn(entry):
     }
 
 
+def station_from_eddn(entry):
+    """Station seen in an EDDN outfitting or shipyard message."""
+    def g(path):
+        return get_in(path, entry, default=None)
+
+    ships = g(["message", "ships"]) or []
+    if any(ship.lower() in large_ships for ship in ships):
+        pad = "L"
+    else:
+        pad = None
+
+    return {
+        "system": g(["message", "systemName"]),
+        "station": g(["message", "stationName"]),
+        "market": g(["message", "marketId"]),
+        "update_time": _eddn_time(entry),
+        "pad": pad,
+    }
+
+
+def station_from_eddn_journal(entry):
+    """Station docked at in an EDDN journal message, or None."""
+    def g(path):
+        return get_in(path, entry, default=None)
+
+    event = g(["message", "event"])
+    docked = (
+        event in ("Docked", "CarrierJump") or
+        (event == "Location" and g(["message", "Docked"]))
+    )
+    if not docked or g(["message", "StationName"]) is None:
+        return None
+
+    type_raw = g(["message", "StationType"])
+    pads = g(["message", "LandingPads"]) or {}
+    if pads.get("Large"):
+        pad = "L"
+    elif pads.get("Medium"):
+        pad = "M"
+    elif pads.get("Small"):
+        pad = "S"
+    else:
+        pad = None
+
+    return {
+        "system": g(["message", "StarSystem"]),
+        "station": g(["message", "StationName"]),
+        "market": g(["message", "MarketID"]),
+        "update_time": _eddn_time(entry),
+        "type": journal_station_types.get(type_raw, type_raw) or "Unknown",
+        "sc_distance": g(["message", "DistFromStarLS"]) or 0,
+        "pad": pad,
+    }
+
+
+def system_from_eddn_journal(entry):
+    """System (with coordinates) from an EDDN journal message, or None."""
+    def g(path):
+        return get_in(path, entry, default=None)
+
+    star_pos = g(["message", "StarPos"])
+    if not star_pos or g(["message", "StarSystem"]) is None:
+        return None
+
+    (x, y, z) = star_pos
+    return {
+        "name": g(["message", "StarSystem"]),
+        "id64": g(["message", "SystemAddress"]),
+        "coords": {"x": x, "y": y, "z": z},
+        "update_time": _eddn_time(entry),
+    }
+
+
+def carrier_from_eddn_fcmaterials(entry):
+    """Fleet carrier from an EDDN fcmaterials message.
+
+    These don't say which system the carrier is in.
+    """
+    def g(path):
+        return get_in(path, entry, default=None)
+
+    return {
+        "station": g(["message", "CarrierID"]),
+        "market": g(["message", "MarketID"]),
+        "update_time": _eddn_time(entry),
+        "type": "Fleet Carrier",
+    }
+
+
 def from_edsm(entry):
     def g(path):
         return get_in(path, entry, default=None)
@@ -76,14 +195,13 @@ def from_edsm(entry):
             "commodities": [],
         }
 
-    update_time_dt = datetime.datetime.strptime(
+    update_time = datetime.datetime.strptime(
         # EDSM entries are in the UTC timezone; I have to fake the timezone
         # being in the string so datetime produces a timezone-aware object
         # instead of a naive one
         update_time_raw + " +00:00",
         "%Y-%m-%d %H:%M:%S %z",
     )
-    update_time = update_time_dt.isoformat()
 
     return {
         "system": system,
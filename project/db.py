@@ -2,25 +2,42 @@
 
 
 import os
+import time
 
 from cytoolz import dissoc
 from diskcache import Cache
 from pymongo import MongoClient
-from pymongo import ASCENDING
-from pymongo import DESCENDING
 
+import ingest_metrics
+import timing
 
-edsm_cache = Cache("edsm-cache")
+
+edsm_cache = Cache(
+    "edsm-cache",
+    size_limit=int(os.environ.get("EDSM_CACHE_BYTES", 256 * 2**20)),
+    eviction_policy="least-recently-used",
+)
 
 
 mongo_url = os.environ.get("MONGO_URL", default="mongodb://localhost:27017/")
 print(f"Using mongo at: {mongo_url}")
-mongo = MongoClient(mongo_url)
+# Market update times are stored as UTC datetimes; read them back as aware
+# datetimes so they can be compared against the current time directly.
+# Every command is counted (and timed) for the metrics in `timing`.
+mongo = MongoClient(
+    mongo_url,
+    tz_aware=True,
+    event_listeners=[timing.MongoCommands()],
+)
 
 dump_meta = mongo.dumpmetadb.dumps
 market = mongo.elite.market
 station = mongo.elite.station
 commodity = mongo.elite.commodities
+systems = mongo.elite.systems
+commodity_prices = mongo.elite.commodity_prices
+# Bumped per system whenever its markets change, to invalidate cached /sales
+system_versions = mongo.elite.system_versions
 
 
 def strip_id(result):
@@ -30,12 +47,40 @@ def strip_id(result):
         return None
 
 
-def build_indices():
-    if not dump_meta.find_one({"operation": "index"}):
-        market.create_index([("system", DESCENDING)])
-        market.create_index([("system", DESCENDING), ("station", DESCENDING)])
-        station.create_index([("system", DESCENDING), ("station", DESCENDING)])
-        dump_meta.insert_one({"operation": "index"})
+class BulkWriter:
+    """Buffer write operations per collection and apply them in bulk.
+
+    Each collection's operations are sent as one unordered `bulk_write` once
+    `batch_size` of them have accumulated, or on `flush()`.  `label` names
+    where the operations came from in the ingest metrics.
+    """
+
+    def __init__(self, batch_size=1000, label=""):
+        self.batch_size = batch_size
+        self.label = label
+        self.pending = {}
+
+    def add(self, collection, operation):
+        (_, ops) = self.pending.setdefault(collection.full_name, (collection, []))
+        ops.append(operation)
+        if len(ops) >= self.batch_size:
+            self._flush(collection.full_name)
 
+    def _flush(self, name):
+        (collection, ops) = self.pending.pop(name, (None, []))
+        if ops:
+            start = time.perf_counter()
+            try:
+                collection.bulk_write(ops, ordered=False)
+            except Exception:
+                ingest_metrics.bulk_write_errors.labels(collection.name).inc()
+                raise
+            ingest_metrics.observe_bulk_write(
+                collection,
+                {self.label: len(ops)},
+                time.perf_counter() - start,
+            )
 
-build_indices()
+    def flush(self):
+        for name in list(self.pending):
+            self._flush(name)
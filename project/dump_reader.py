@@ -0,0 +1,165 @@
+import codecs
+import gzip
+import json
+import os
+from contextlib import contextmanager
+
+import requests
+
+
+chunk_size = 1 << 20
+
+_decoder = json.JSONDecoder()
+_separators = " \t\r\n,["
+
+
+class Progress:
+    """How much of a dump's compressed stream has been read so far.
+
+    `total` is the compressed size, or None if the server didn't say.
+    """
+
+    def __init__(self):
+        self.read = 0
+        self.total = None
+
+    def ratio(self):
+        if not self.total:
+            return 0.0
+        return min(1.0, self.read / self.total)
+
+
+class _Counting:
+    """File-like wrapper counting the bytes read through it."""
+
+    def __init__(self, raw, progress):
+        self.raw = raw
+        self.progress = progress
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.progress.read += len(data)
+        return data
+
+    def close(self):
+        self.raw.close()
+
+
+@contextmanager
+def open_dump(source, progress=None):
+    """Open a gzipped dump from a URL or a local path as a binary stream.
+
+    If `progress` is given, it is kept up to date as the dump is read.
+    """
+    if source.startswith("http://") or source.startswith("https://"):
+        res = requests.get(source, stream=True)
+        res.raise_for_status()
+        # Let urllib3 undo any transfer encoding, gzip handles the file itself
+        res.raw.decode_content = True
+        raw = res.raw
+        size = res.headers.get("Content-Length")
+    else:
+        raw = open(source, "rb")
+        size = os.path.getsize(source)
+    if progress is not None:
+        progress.read = 0
+        progress.total = int(size) if size is not None else None
+        raw = _Counting(raw, progress)
+    try:
+        with gzip.GzipFile(fileobj=raw) as stream:
+            yield stream
+    finally:
+        raw.close()
+
+
+def _skip(stream, offset):
+    remaining = offset
+    while remaining > 0:
+        chunk = stream.read(min(chunk_size, remaining))
+        if not chunk:
+            raise ValueError(f"Dump ends before offset {offset}")
+        remaining -= len(chunk)
+
+
+def iter_json_array(stream, offset=0):
+    """Yield (offset, item) for each item of a JSON array in `stream`.
+
+    Only the item being parsed is held in memory.  `offset` is the position
+    in the decompressed stream just past each item; passing it back in
+    resumes parsing with the following item.
+    """
+    _skip(stream, offset)
+    text = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    # `buf_offset` is the stream offset of buf[start]; everything before
+    # `start` has been parsed and is dropped on the next read
+    buf_offset = offset
+    start = 0
+    pos = 0
+    eof = False
+
+    while True:
+        # Skip the array punctuation between items
+        while pos < len(buf) and buf[pos] in _separators:
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+
+        if pos < len(buf):
+            try:
+                (item, end) = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                consumed = buf[start:end]
+                if consumed.isascii():
+                    buf_offset += len(consumed)
+                else:
+                    buf_offset += len(consumed.encode("utf-8"))
+                start = pos = end
+                yield (buf_offset, item)
+                continue
+        elif eof:
+            return
+
+        # Need more input, either to find the next item or to finish this one
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buf = buf[start:] + text.decode(chunk, final=eof)
+        pos -= start
+        start = 0
+
+
+def read_line_chunks(source, offset=0, lines=1000, progress=None):
+    """Yield (offset, lines) for chunks of raw lines of a dump.
+
+    Nothing is parsed, so this only splits dumps written one item per line
+    (as EDSM's are) into items; see `parse_line`.  `offset` is the position
+    in the decompressed stream just past each chunk, and can be passed to
+    this or to `read_dump` to resume.
+    """
+    with open_dump(source, progress=progress) as stream:
+        _skip(stream, offset)
+        chunk = []
+        for line in stream:
+            offset += len(line)
+            chunk.append(line)
+            if len(chunk) >= lines:
+                yield (offset, chunk)
+                chunk = []
+        if chunk:
+            yield (offset, chunk)
+
+
+def parse_line(line):
+    """The item on a line of a one-item-per-line dump, or None if none."""
+    text = line.strip().lstrip(b"[").rstrip(b"]").rstrip(b",").strip()
+    if not text:
+        return None
+    return json.loads(text)
+
+
+def read_dump(source, offset=0, progress=None):
+    with open_dump(source, progress=progress) as stream:
+        yield from iter_json_array(stream, offset=offset)
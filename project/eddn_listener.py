@@ -7,64 +7,323 @@ import json
 import sys
 import time
 import os
+from collections import Counter
 
 from pymongo import MongoClient
+from pymongo import UpdateMany
+from pymongo import UpdateOne
 
+from coalescing_writer import CoalescingWriter
+import commodity_prices
+import result_cache
+from conversion import carrier_from_eddn_fcmaterials
 from conversion import from_eddn
+from conversion import station_from_eddn
+from conversion import station_from_eddn_journal
+from conversion import system_from_eddn_journal
 import db
+import ingest_metrics
 
 
-relayEDDN = "tcp://eddn.edcd.io:9500"
+# Point at a local publisher (see eddn_replay.py) to test against recordings
+relayEDDN = os.environ.get("EDDN_RELAY", "tcp://eddn.edcd.io:9500")
 timeoutEDDN = 600000
 
-def save_to_mongo(data):
-    if data["$schemaRef"] != "https://eddn.edcd.io/schemas/commodity/3":
-        return
+queue_size = int(os.environ.get("EDDN_QUEUE_SIZE", 10000))
+flush_messages = int(os.environ.get("EDDN_FLUSH_MESSAGES", 500))
+flush_ms = int(os.environ.get("EDDN_FLUSH_MS", 1000))
+stats_seconds = int(os.environ.get("EDDN_STATS_SECONDS", 60))
+# Log full payloads instead of summaries (for debugging, this is expensive)
+trace = bool(os.environ.get("EDDN_TRACE"))
+# Log every Nth message; 0 disables per-message logging
+log_every = int(os.environ.get("EDDN_LOG_EVERY", 1 if trace else 0))
+
+
+# Handlers for each $schemaRef we ingest.  A handler converts the message
+# and submits its writes to the writer.
+handlers = {}
+
+
+def handles(*schemas):
+    def register(func):
+        for schema in schemas:
+            handlers[schema] = func
+        return func
+    return register
+
+
+def schema_label(data):
+    return ingest_metrics.schema_label(data.get("$schemaRef"))
+
+
+def save_to_mongo(data, writer):
+    handler = handlers.get(data["$schemaRef"])
+    if handler is not None:
+        handler(data, writer)
+        ingest_metrics.eddn_messages.labels(
+            schema_label(data),
+            "decoded",
+        ).inc()
+
 
+@handles("https://eddn.edcd.io/schemas/commodity/3")
+def save_commodity(data, writer):
     converted = from_eddn(data)
     system = converted["system"]
     station = converted["station"]
     update_time = converted["update_time"]
     commodities = converted["commodities"]
-    db.market.update_one(
-        {"system": system, "station": station},
-        {
-            "$set": {
-                "system": system,
-                "station": station,
-                "update_time": update_time,
-                "commodities": commodities,
-                "source": "eddn",
+    writer.submit(
+        db.market,
+        (system, station),
+        update_time,
+        UpdateOne(
+            {"system": system, "station": station},
+            {
+                "$set": {
+                    "system": system,
+                    "station": station,
+                    "update_time": update_time,
+                    "commodities": commodities,
+                    "source": "eddn",
+                },
+                # When we wrote it, which the market snapshot polls on
+                "$currentDate": {"written_at": True},
+            },
+            upsert=True,
+        ),
+        label=schema_label(data),
+    )
+    writer.submit(
+        db.commodity_prices,
+        (system, station),
+        update_time,
+        commodity_prices.operations(
+            system,
+            station,
+            update_time,
+            commodities,
+            "eddn",
+        ),
+        label=schema_label(data),
+    )
+    # Bumping before the market is written could let a stale response be
+    # cached as current, so the writer holds this back until it has been
+    writer.submit(
+        db.system_versions,
+        system,
+        update_time,
+        result_cache.bump_operation(system),
+        label=schema_label(data),
+        after=(db.market, (system, station)),
+    )
+
+
+@handles(
+    "https://eddn.edcd.io/schemas/outfitting/2",
+    "https://eddn.edcd.io/schemas/shipyard/2",
+)
+def save_station_seen(data, writer):
+    converted = station_from_eddn(data)
+    system = converted["system"]
+    station = converted["station"]
+    fields = {"market": converted["market"], "seen": converted["update_time"]}
+    if converted["pad"]:
+        fields["pad"] = converted["pad"]
+    # Only refresh stations we know; these messages don't carry a type
+    writer.submit(
+        db.station,
+        ("seen", data["$schemaRef"], system, station),
+        converted["update_time"],
+        UpdateOne(
+            {"system": system, "station": station},
+            {"$set": fields},
+        ),
+        label=schema_label(data),
+    )
+
+
+@handles("https://eddn.edcd.io/schemas/journal/1")
+def save_journal(data, writer):
+    system = system_from_eddn_journal(data)
+    if system is not None:
+        # Only refresh systems system_dump loaded; galaxy.get_index loads
+        # them all, and the journal reaches far more systems than those
+        writer.submit(
+            db.systems,
+            ("coords", system["name"]),
+            system["update_time"],
+            UpdateOne(
+                {"name": system["name"]},
+                {
+                    "$set": {
+                        "id64": system["id64"],
+                        "coords": system["coords"],
+                    },
+                },
+            ),
+            label=schema_label(data),
+        )
+
+    station = station_from_eddn_journal(data)
+    if station is not None:
+        fields = {
+            "system": station["system"],
+            "station": station["station"],
+            "market": station["market"],
+            "type": station["type"],
+            "sc_distance": station["sc_distance"],
+            "seen": station["update_time"],
+        }
+        if station["pad"]:
+            fields["pad"] = station["pad"]
+        writer.submit(
+            db.station,
+            ("docked", station["system"], station["station"]),
+            station["update_time"],
+            UpdateOne(
+                {"system": station["system"], "station": station["station"]},
+                {"$set": fields},
+                upsert=True,
+            ),
+            label=schema_label(data),
+        )
+
+
+@handles(
+    "https://eddn.edcd.io/schemas/fcmaterials_journal/1",
+    "https://eddn.edcd.io/schemas/fcmaterials_capi/1",
+)
+def save_carrier(data, writer):
+    carrier = carrier_from_eddn_fcmaterials(data)
+    if carrier["station"] is None:
+        return
+    # We don't know the carrier's system, so mark it wherever we have it
+    writer.submit(
+        db.station,
+        ("carrier", carrier["station"]),
+        carrier["update_time"],
+        UpdateMany(
+            {"station": carrier["station"]},
+            {
+                "$set": {
+                    "type": carrier["type"],
+                    "market": carrier["market"],
+                    "seen": carrier["update_time"],
+                },
             },
-        },
-        upsert=True,
+        ),
+        label=schema_label(data),
     )
-    print(json.dumps(data))
+
+
+class Stats:
+    """Message counts for the current logging interval."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.messages = 0
+        self.schemas = Counter()
+
+    def record(self, data):
+        self.messages += 1
+        self.schemas[data.get("$schemaRef")] += 1
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+
+def log(event, **fields):
+    print(json.dumps({"event": event, **fields}, default=str))
     sys.stdout.flush()
 
 
+def log_message(data):
+    if trace:
+        log("message", data=data)
+    else:
+        message = data.get("message", {})
+        log(
+            "message",
+            schema=data.get("$schemaRef"),
+            system=message.get("systemName"),
+            station=message.get("stationName"),
+            gateway_timestamp=data.get("header", {}).get("gatewayTimestamp"),
+        )
+
+
+def log_stats(stats, writer):
+    elapsed = stats.elapsed()
+    log(
+        "stats",
+        seconds=round(elapsed, 1),
+        messages=stats.messages,
+        messages_per_second=round(stats.messages / elapsed, 2),
+        schemas=dict(stats.schemas),
+        writer=writer.stats(),
+    )
+
+
 def main():
+    writer = CoalescingWriter(
+        queue_size=queue_size,
+        flush_messages=flush_messages,
+        flush_ms=flush_ms,
+    ).start()
+    stats = Stats()
+    ingest_metrics.writer_queue_depth.set_function(writer.queue.qsize)
+    ingest_metrics.serve(9101)
+
     context = zmq.Context()
     subscriber = context.socket(zmq.SUB)
 
     subscriber.setsockopt(zmq.SUBSCRIBE, b"")
-    subscriber.setsockopt(zmq.RCVTIMEO, timeoutEDDN)
+    poller = zmq.Poller()
+    poller.register(subscriber, zmq.POLLIN)
 
     while True:
         try:
             subscriber.connect(relayEDDN)
+            ingest_metrics.eddn_reconnects.inc()
+            last_message = time.monotonic()
 
             while True:
-                message = subscriber.recv()
+                # Wake up at least once a second so stats are still logged
+                # while the relay is quiet
+                if poller.poll(1000):
+                    message = subscriber.recv()
+                    last_message = time.monotonic()
+
+                    try:
+                        json_ = json.loads(zlib.decompress(message))
+                    except (zlib.error, ValueError) as e:
+                        ingest_metrics.eddn_errors.labels("decode").inc()
+                        log("undecodable", error=str(e))
+                        continue
+                    ingest_metrics.eddn_messages.labels(
+                        schema_label(json_),
+                        "received",
+                    ).inc()
+                    save_to_mongo(json_, writer)
 
-                if message == False:
+                    stats.record(json_)
+                    if log_every and stats.messages % log_every == 0:
+                        log_message(json_)
+                elif time.monotonic() - last_message > timeoutEDDN / 1000:
+                    log("timeout", relay=relayEDDN)
+                    ingest_metrics.eddn_timeouts.inc()
                     subscriber.disconnect(relayEDDN)
                     break
 
-                json_ = json.loads(zlib.decompress(message))
-                save_to_mongo(json_)
+                if stats.elapsed() > stats_seconds:
+                    log_stats(stats, writer)
+                    stats.reset()
 
         except zmq.ZMQError as e:
+            ingest_metrics.eddn_errors.labels("zmq").inc()
             print("ZMQSocketException: " + str(e))
             sys.stdout.flush()
             subscriber.disconnect(relayEDDN)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+
+import json
+import os
+import shlex
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import zmq
+
+
+# Each recorded frame: seconds since the recording started, then the length
+# of the raw (still zlib-compressed) message, then the message itself
+frame_header = struct.Struct("<dI")
+
+
+def record(relay, path, seconds=None, count=None):
+    """Record raw EDDN frames from `relay` to `path`."""
+    context = zmq.Context()
+    subscriber = context.socket(zmq.SUB)
+    subscriber.setsockopt(zmq.SUBSCRIBE, b"")
+    subscriber.connect(relay)
+
+    recorded = 0
+    with open(path, "wb") as f:
+        start = time.monotonic()
+        while True:
+            elapsed = time.monotonic() - start
+            if seconds is not None and elapsed > seconds:
+                break
+            if count is not None and recorded >= count:
+                break
+            if not subscriber.poll(1000):
+                continue
+            message = subscriber.recv()
+            offset = time.monotonic() - start
+            f.write(frame_header.pack(offset, len(message)))
+            f.write(message)
+            recorded += 1
+            if recorded % 1000 == 0:
+                print(f"Recorded {recorded} messages in {offset:.0f}s")
+    subscriber.close()
+    print(f"Recorded {recorded} messages to {path}")
+    return recorded
+
+
+def read_frames(path):
+    """(offset seconds, raw message) for each frame recorded in `path`."""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(frame_header.size)
+            if len(header) < frame_header.size:
+                return
+            (offset, length) = frame_header.unpack(header)
+            yield (offset, f.read(length))
+
+
+def _read_stats(stream, lines):
+    for line in stream:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(entry, dict) and entry.get("event") == "stats":
+            entry["at"] = time.monotonic()
+            lines.append(entry)
+
+
+def _check_running(process):
+    if process.poll() is not None:
+        raise RuntimeError(f"Listener exited with {process.returncode}")
+
+
+def replay(
+    path,
+    speed=1.0,
+    port=9599,
+    listener=None,
+    warmup=2.0,
+    drain=5.0,
+):
+    """Replay a recording into a listener process and measure its ingest.
+
+    The listener is started with EDDN_RELAY pointed at a local PUB socket
+    and logs its stats every second.  `speed` scales the recorded pacing;
+    None sends as fast as possible.  Once everything is sent we wait until
+    the listener has gone `drain` seconds without receiving anything and
+    its writer queue is empty.
+    """
+    frames = list(read_frames(path))
+    address = f"tcp://127.0.0.1:{port}"
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.bind(address)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = listener or [sys.executable, "eddn_listener.py"]
+    process = subprocess.Popen(
+        command,
+        cwd=here,
+        env={
+            **os.environ,
+            "EDDN_RELAY": address,
+            "EDDN_STATS_SECONDS": "1",
+            # Don't clash with a listener already serving metrics here
+            "METRICS_PORT": "0",
+        },
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    stats = []
+    reader = threading.Thread(
+        target=_read_stats,
+        args=(process.stdout, stats),
+        daemon=True,
+    )
+    reader.start()
+
+    try:
+        # PUB drops everything sent before the subscriber has connected
+        time.sleep(warmup)
+        start = time.monotonic()
+        for (offset, message) in frames:
+            if speed is not None:
+                delay = start + offset / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            publisher.send(message)
+        sent_seconds = time.monotonic() - start
+
+        # Wait until the listener has caught up, or has stopped receiving
+        # anything for `drain` seconds
+        while True:
+            time.sleep(1)
+            _check_running(process)
+            if not stats or stats[-1]["writer"]["queue_depth"]:
+                continue
+            received = sum(s["messages"] for s in stats)
+            last_busy = max(
+                [start + sent_seconds] +
+                [s["at"] for s in stats if s["messages"]]
+            )
+            if (
+                received >= len(frames) or
+                time.monotonic() - last_busy > drain
+            ):
+                break
+        # One more stats line, so the final flush is counted
+        seen = len(stats)
+        while len(stats) <= seen:
+            _check_running(process)
+            time.sleep(0.2)
+    finally:
+        process.terminate()
+        process.wait()
+        publisher.close()
+
+    return report(frames, speed, sent_seconds, stats)
+
+
+def report(frames, speed, sent_seconds, stats):
+    received = sum(s["messages"] for s in stats)
+    busy = [s for s in stats if s["messages"]]
+    busy_seconds = sum(s["seconds"] for s in busy)
+    writer = stats[-1]["writer"] if stats else {}
+    return {
+        "messages": len(frames),
+        "speed": speed or "max",
+        "recorded_seconds": round(frames[-1][0], 1) if frames else 0,
+        "sent_seconds": round(sent_seconds, 1),
+        "sent_per_second": (
+            round(len(frames) / sent_seconds, 1) if sent_seconds else None
+        ),
+        "received": received,
+        # Dropped between the PUB and SUB sockets: the listener wasn't
+        # reading fast enough to stay under ZMQ's high water mark
+        "socket_dropped": len(frames) - received,
+        "writer_dropped": writer.get("dropped"),
+        "messages_per_second": (
+            round(received / busy_seconds, 1) if busy_seconds else None
+        ),
+        "peak_messages_per_second": max(
+            (s["messages_per_second"] for s in busy),
+            default=None,
+        ),
+        "write_lag_ms": writer.get("lag_ms"),
+        "write_ms": writer.get("write_ms"),
+        "writer": {
+            k: writer.get(k)
+            for k in (
+                "received",
+                "coalesced",
+                "written",
+                "flushes",
+                "errors",
+                "skipped",
+            )
+        },
+    }
+
+
+def _speed(value):
+    if value == "max":
+        return None
+    return float(value.rstrip("x"))
+
+
+def main():
+    import argparse
+    import eddn_listener
+
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--relay", default=eddn_listener.relayEDDN)
+    record_parser.add_argument("--seconds", type=float, default=None)
+    record_parser.add_argument("--count", type=int, default=None)
+
+    replay_parser = commands.add_parser("replay")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument(
+        "--speed",
+        type=_speed,
+        nargs="+",
+        default=[1.0, 10.0, None],
+        help="Pacing multipliers, e.g. 1 10 max",
+    )
+    replay_parser.add_argument("--port", type=int, default=9599)
+    replay_parser.add_argument(
+        "--listener",
+        type=shlex.split,
+        default=None,
+        help="Command running the listener (default: eddn_listener.py)",
+    )
+    replay_parser.add_argument("--warmup", type=float, default=2.0)
+    replay_parser.add_argument("--drain", type=float, default=5.0)
+    replay_parser.add_argument("--output", default=None)
+    parsed = parser.parse_args()
+
+    if parsed.command == "record":
+        record(
+            parsed.relay,
+            parsed.path,
+            seconds=parsed.seconds,
+            count=parsed.count,
+        )
+    elif parsed.command == "replay":
+        results = []
+        for speed in parsed.speed:
+            result = replay(
+                parsed.path,
+                speed=speed,
+                port=parsed.port,
+                listener=parsed.listener,
+                warmup=parsed.warmup,
+                drain=parsed.drain,
+            )
+            print(json.dumps(result))
+            results.append(result)
+        if parsed.output:
+            with open(parsed.output, "w") as f:
+                json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,84 @@
+import threading
 import time
 
 import requests
+from requests.adapters import HTTPAdapter
 from retrying import retry
 
 
+class TokenBucket:
+    """Rate limiter kept in step with EDSM's X-Rate-Limit-* headers.
+
+    Requests go out immediately while tokens remain; we only wait once the
+    bucket is empty.
+    """
+
+    def __init__(self, capacity=720, refill_seconds=3600):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.rate = capacity / refill_seconds
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.rate,
+        )
+        self.updated = now
+
+    def reserve(self):
+        """Take a token, returning how long to wait before using it."""
+        with self.lock:
+            self._refill()
+            wait = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            # Take the token now, waiting callers queue up behind us
+            self.tokens -= 1
+        return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    def update(self, headers):
+        """Resync with the limits the server reported."""
+        limit = headers.get("X-Rate-Limit-Limit")
+        remaining = headers.get("X-Rate-Limit-Remaining")
+        reset = headers.get("X-Rate-Limit-Reset")
+        with self.lock:
+            self._refill()
+            if limit is not None:
+                self.capacity = int(limit)
+            if remaining is not None:
+                self.tokens = int(remaining)
+            if reset is not None and remaining is not None:
+                missing = self.capacity - int(remaining)
+                if missing > 0 and int(reset) > 0:
+                    self.rate = missing / int(reset)
+
+    def empty(self, retry_after):
+        """The server says we're out; nothing is available for a while."""
+        with self.lock:
+            self.tokens = -retry_after * self.rate
+            self.updated = time.monotonic()
+
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+bucket = TokenBucket()
+
+
 @retry(stop_max_attempt_number=3)
 def _get_with_http(url, params):
     print(f"GET {url} ({params})...")
-    r = requests.get(url, params=params)
-    rate_limit = int(r.headers.get("X-Rate-Limit-Limit", 720))
-    rate_reset = int(r.headers.get("X-Rate-Limit-Reset", 0))
-    retry_after = int(r.headers.get("Retry-After", 0))
-    request_interval = rate_reset / rate_limit
-    request_preroll = 50
+    bucket.acquire()
+    r = session.get(url, params=params)
+    bucket.update(r.headers)
     if r.status_code == 429:
         print(f"Rate-limited: {r.headers}")
-        # Sleep for long enough to get a few prerolled requests
-        time.sleep(retry_after + request_preroll * request_interval)
+        bucket.empty(int(r.headers.get("Retry-After", 0)))
         # Raise so we get retried
         r.raise_for_status()
     else:
@@ -26,7 +88,6 @@ def _get_with_http(url, params):
             print(f"<<<< REQUEST\n{r.request.__dict__}")
             print(f">>>> RESPONSE\n{r.__dict__}")
             raise
-    time.sleep(request_interval)
     return r
 
 
@@ -0,0 +1,90 @@
+import asyncio
+
+import httpx
+
+from edsm import bucket
+
+
+_client = None
+
+
+def client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=30,
+            limits=httpx.Limits(max_keepalive_connections=16),
+        )
+    return _client
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _get_with_http(url, params, attempts=3):
+    for attempt in range(1, attempts + 1):
+        print(f"GET {url} ({params})...")
+        # Shares the rate limit with the synchronous client
+        await asyncio.sleep(bucket.reserve())
+        try:
+            r = await client().get(url, params=params)
+            bucket.update(r.headers)
+            if r.status_code == 429:
+                print(f"Rate-limited: {r.headers}")
+                bucket.empty(int(r.headers.get("Retry-After", 0)))
+            r.raise_for_status()
+            return r
+        except httpx.HTTPError:
+            if attempt == attempts:
+                raise
+
+
+async def _get_raw(url, params):
+    return (await _get_with_http(url, params)).json()
+
+
+async def location_raw(name, api_key):
+    return await _get_raw(
+        "https://www.edsm.net/api-logs-v1/get-position",
+        params={
+            "commanderName": name,
+            "apiKey": api_key,
+        },
+    )
+
+
+async def cargo_raw(name, api_key):
+    return await _get_raw(
+        "https://www.edsm.net/api-commander-v1/get-materials",
+        params={
+            "commanderName": name,
+            "apiKey": api_key,
+            "type": "cargo",
+        },
+    )
+
+
+async def systems_in_sphere_raw(current_system, radius=50, min_radius=0):
+    """Get systems in a sphere of radius 50 of another system."""
+    return await _get_raw(
+        "https://www.edsm.net/api-v1/sphere-systems",
+        params={
+            "systemName": current_system,
+            "radius": radius,
+            "minRadius": min_radius,
+            "showInformation": 1,
+            "showPrimaryStar": 1,
+            "showCoordinates": 1,
+        },
+    )
+
+
+async def stations_in_system_raw(system):
+    return await _get_raw(
+        "https://www.edsm.net/api-system-v1/stations",
+        params={"systemName": system},
+    )
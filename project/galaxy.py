@@ -0,0 +1,105 @@
+import math
+import os
+import time
+from collections import defaultdict
+
+import db
+
+
+# Edge length of the grid cells, in ly.  Most queries are in the 10-100 ly
+# range, so this keeps the number of cells touched per query small without
+# making each cell huge in the populated bubble.
+cell_size = float(os.environ.get("GALAXY_CELL_SIZE", 20))
+
+# How long a loaded index is trusted before we reload it from mongo
+reload_seconds = float(os.environ.get("GALAXY_RELOAD_SECONDS", 3600))
+
+
+def _cell(x, y, z):
+    return (
+        math.floor(x / cell_size),
+        math.floor(y / cell_size),
+        math.floor(z / cell_size),
+    )
+
+
+class GalaxyIndex:
+    """Uniform grid over system coordinates for fast radius queries."""
+
+    def __init__(self, systems):
+        self.cells = defaultdict(list)
+        self.by_name = {}
+        for system in systems:
+            coords = system.get("coords")
+            if not coords:
+                continue
+            entry = (system["name"], coords["x"], coords["y"], coords["z"])
+            self.cells[_cell(entry[1], entry[2], entry[3])].append(entry)
+            self.by_name[system["name"].lower()] = entry
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def coords(self, name):
+        entry = self.by_name.get(name.lower())
+        if entry is None:
+            return None
+        return {"x": entry[1], "y": entry[2], "z": entry[3]}
+
+    def sphere(self, name, radius=30, min_radius=0):
+        """Systems around `name`, shaped like EDSM's sphere-systems output.
+
+        Returns None if `name` is not in the index.
+        """
+        center = self.by_name.get(name.lower())
+        if center is None:
+            return None
+
+        (_, cx, cy, cz) = center
+        (lo_x, lo_y, lo_z) = _cell(cx - radius, cy - radius, cz - radius)
+        (hi_x, hi_y, hi_z) = _cell(cx + radius, cy + radius, cz + radius)
+        r2 = radius * radius
+        min_r2 = min_radius * min_radius
+
+        found = []
+        for i in range(lo_x, hi_x + 1):
+            for j in range(lo_y, hi_y + 1):
+                for k in range(lo_z, hi_z + 1):
+                    for (sys_name, x, y, z) in self.cells.get((i, j, k), ()):
+                        d2 = (x - cx)**2 + (y - cy)**2 + (z - cz)**2
+                        if min_r2 <= d2 <= r2:
+                            found.append({
+                                "name": sys_name,
+                                "distance": round(math.sqrt(d2), 2),
+                                "coords": {"x": x, "y": y, "z": z},
+                            })
+
+        return sorted(found, key=lambda x: x["distance"])
+
+
+_index = None
+_loaded_at = 0
+
+
+def load_index():
+    systems = db.systems.find({}, {"_id": 0, "name": 1, "coords": 1})
+    return GalaxyIndex(systems)
+
+
+def get_index():
+    global _index
+    global _loaded_at
+    if _index is None or time.time() - _loaded_at > reload_seconds:
+        _index = load_index()
+        _loaded_at = time.time()
+        print(f"Loaded galaxy index with {len(_index)} systems")
+    return _index
+
+
+def systems_in_sphere(name, radius=30, min_radius=0):
+    """Local equivalent of `edsm.systems_in_sphere_raw`.
+
+    Returns None if the system is unknown, so the caller can fall back to
+    EDSM.
+    """
+    return get_index().sphere(name, radius=radius, min_radius=min_radius)
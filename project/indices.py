@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+
+
+import datetime
+import sys
+
+from pymongo import ASCENDING
+from pymongo import DESCENDING
+from pymongo.errors import PyMongoError
+
+import db
+
+
+# Every index the code relies on, as (collection, keys, options).  Reconcile
+# on deploy with `indices.py reconcile`; `indices.py check` verifies that the
+# hot queries actually use them.
+spec = [
+    (db.market, [("system", DESCENDING)], {}),
+    (db.market, [("system", DESCENDING), ("station", DESCENDING)], {}),
+    (db.market, [("system", DESCENDING), ("update_time", DESCENDING)], {}),
+    # Market snapshot polling and the update_time migration
+    (db.market, [("update_time", DESCENDING)], {}),
+    (db.market, [("source", DESCENDING)], {}),
+    # Market snapshot polling
+    (db.market, [("written_at", DESCENDING)], {}),
+    (db.market, [("commodities.name", DESCENDING)], {}),
+    (db.station, [("system", DESCENDING), ("station", DESCENDING)], {}),
+    # Fleet carriers are found by name alone from fcmaterials messages
+    (db.station, [("station", DESCENDING)], {}),
+    (db.commodity, [("name", DESCENDING)], {}),
+    (db.commodity, [("readable", DESCENDING)], {}),
+    (db.systems, [("name", ASCENDING)], {"unique": True}),
+    (
+        db.commodity_prices,
+        [("name", DESCENDING), ("system", DESCENDING)],
+        {},
+    ),
+    (
+        db.commodity_prices,
+        [("system", DESCENDING), ("station", DESCENDING)],
+        {},
+    ),
+    # One version document per system, even when the listener and the dump
+    # loader bump a new system at once (the server retries the losing upsert)
+    (db.system_versions, [("system", ASCENDING)], {"unique": True}),
+    # Lets version lookups be answered from the index alone
+    (
+        db.system_versions,
+        [("system", DESCENDING), ("version", DESCENDING)],
+        {},
+    ),
+]
+
+
+def _key(keys):
+    return tuple(
+        (field, direction if isinstance(direction, str) else int(direction))
+        for (field, direction) in keys
+    )
+
+
+def _collections():
+    return list({c.full_name: c for (c, _, _) in spec}.values())
+
+
+def reconcile():
+    """Create every index in `spec` that doesn't exist yet."""
+    created = []
+    for collection in _collections():
+        existing = {
+            _key(info["key"])
+            for info in collection.index_information().values()
+        }
+        for (c, keys, options) in spec:
+            if c.full_name == collection.full_name:
+                if _key(keys) not in existing:
+                    name = collection.create_index(keys, **options)
+                    created.append(f"{collection.name}.{name}")
+    print(f"Indices reconciled, created: {created or 'none'}")
+    return created
+
+
+def usage():
+    """Access counts for every index, from $indexStats.
+
+    Counts start over when mongod restarts; see `since`.
+    """
+    for collection in _collections():
+        wanted = {
+            _key(keys)
+            for (c, keys, _) in spec
+            if c.full_name == collection.full_name
+        }
+        for stats in collection.aggregate([{"$indexStats": {}}]):
+            if stats["name"] == "_id_":
+                continue
+            yield {
+                "collection": collection.name,
+                "index": stats["name"],
+                "ops": stats["accesses"]["ops"],
+                "since": stats["accesses"]["since"],
+                "in_spec": _key(stats["key"].items()) in wanted,
+            }
+
+
+def report_unused():
+    unused = [u for u in usage() if not u["ops"] or not u["in_spec"]]
+    for u in unused:
+        reason = "unused" if not u["ops"] else "not in spec"
+        print(
+            f"{u['collection']}.{u['index']}: {reason} "
+            f"({u['ops']} ops since {u['since']})"
+        )
+    if not unused:
+        print("Every index is in the spec and has been used")
+    return unused
+
+
+class _Recorder:
+    """Stands in for a writer, keeping the writes instead of sending them."""
+
+    def __init__(self):
+        self.writes = []
+
+    def add(self, collection, operation):
+        self.writes.append((collection, operation))
+
+    def submit(
+        self,
+        collection,
+        key,
+        timestamp,
+        operation,
+        label="",
+        after=None,
+    ):
+        if not isinstance(operation, list):
+            operation = [operation]
+        self.writes.extend((collection, op) for op in operation)
+
+
+def _samples():
+    market = db.market.find_one({}, {"_id": 0}) or {
+        "system": "Sol",
+        "station": "Abraham Lincoln",
+        "commodities": [{"name": "gold"}],
+    }
+    system = market["system"]
+    station = market["station"]
+    names = [c["name"] for c in market.get("commodities", [])][:3] or ["gold"]
+    gateway = {
+        "gatewayTimestamp": datetime.datetime.now(
+            datetime.timezone.utc,
+        ).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    }
+    eddn_messages = [
+        {
+            "$schemaRef": "https://eddn.edcd.io/schemas/commodity/3",
+            "header": gateway,
+            "message": {
+                "systemName": system,
+                "stationName": station,
+                "marketId": 1,
+                "commodities": [
+                    {
+                        "name": name,
+                        "sellPrice": 1,
+                        "buyPrice": 1,
+                        "stock": 1,
+                        "demand": 1,
+                    }
+                    for name in names
+                ],
+            },
+        },
+        {
+            "$schemaRef": "https://eddn.edcd.io/schemas/journal/1",
+            "header": gateway,
+            "message": {
+                "event": "Docked",
+                "StarSystem": system,
+                "StarPos": [0, 0, 0],
+                "SystemAddress": 1,
+                "StationName": station,
+                "StationType": "Coriolis",
+                "MarketID": 1,
+            },
+        },
+        {
+            "$schemaRef": "https://eddn.edcd.io/schemas/shipyard/2",
+            "header": gateway,
+            "message": {
+                "systemName": system,
+                "stationName": station,
+                "marketId": 1,
+                "ships": [],
+            },
+        },
+        {
+            "$schemaRef": "https://eddn.edcd.io/schemas/fcmaterials_capi/1",
+            "header": gateway,
+            "message": {"CarrierID": station, "MarketID": 1, "Items": {}},
+        },
+    ]
+    dump_entry = {
+        "systemName": system,
+        "name": station,
+        "marketId": 1,
+        "type": "Coriolis Starport",
+        "distanceToArrival": 1,
+        "updateTime": {"market": "2020-01-01 00:00:00"},
+        "commodities": [
+            {
+                "id": name,
+                "name": name.title(),
+                "sellPrice": 1,
+                "buyPrice": 1,
+                "stock": 1,
+                "demand": 1,
+            }
+            for name in names
+        ],
+    }
+    return (
+        market,
+        [system],
+        {name: 1 for name in names},
+        eddn_messages,
+        dump_entry,
+    )
+
+
+def explain_plans():
+    """(description, explain output) for the queries issued on hot paths.
+
+    The queries come from the same functions the API, listener and dump
+    loader call, so they can't drift from what actually runs.
+    """
+    import commodity_prices
+    import eddn_listener
+    import main
+    import station_dump
+
+    (market, systems, cargo, eddn_messages, dump_entry) = _samples()
+    updated_after = main._updated_after(24 * 3600)
+    database = db.market.database
+
+    def explain(command):
+        return database.command(
+            {"explain": command, "verbosity": "queryPlanner"},
+        )
+
+    yield (
+        "best_sell_stations: candidate systems",
+        explain({
+            "distinct": db.commodity_prices.name,
+            "key": "system",
+            "query": commodity_prices.candidate_query(
+                cargo,
+                systems,
+                updated_after=updated_after,
+            ),
+        }),
+    )
+    for disallowed_types in (None, ["Fleet Carrier"]):
+        yield (
+            f"best_sell_stations: sales pipeline ({disallowed_types=})",
+            explain({
+                "aggregate": db.market.name,
+                "pipeline": main.sales_pipeline(
+                    systems,
+                    cargo,
+                    disallowed_types=disallowed_types,
+                ),
+                "cursor": {},
+            }),
+        )
+    yield (
+        "best_sell_stations: markets in systems",
+        db.market.find(
+            main._in_systems_query(
+                systems,
+                {"update_time": {"$gt": updated_after}},
+            ),
+        ).explain(),
+    )
+    yield (
+        "best_sell_stations: join_stations",
+        db.station.find(main._in_systems_query(systems)).explain(),
+    )
+    yield (
+        "filter_market: station data",
+        db.station.find(main._station_query(market)).explain(),
+    )
+
+    recorder = _Recorder()
+    station_dump.save_to_mongo(dump_entry, recorder, {})
+    for message in eddn_messages:
+        eddn_listener.save_to_mongo(message, recorder)
+    for (collection, operation) in recorder.writes:
+        yield (
+            f"save_to_mongo: {type(operation).__name__} {collection.name}",
+            # The planner picks the same plan for a write's filter as for a
+            # find on it
+            collection.find(operation._filter).explain(),
+        )
+
+
+def _stages(explained):
+    if isinstance(explained, dict):
+        for (key, value) in explained.items():
+            if key == "stage":
+                yield value
+            else:
+                yield from _stages(value)
+    elif isinstance(explained, list):
+        for value in explained:
+            yield from _stages(value)
+
+
+def check():
+    """Explain the hot queries; returns those doing a collection scan."""
+    failed = []
+    for (description, explained) in explain_plans():
+        stages = set(_stages(explained))
+        if "COLLSCAN" in stages:
+            failed.append(description)
+            print(f"COLLSCAN {description}")
+        else:
+            print(f"ok       {description} ({', '.join(sorted(stages))})")
+    return failed
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "command",
+        choices=["reconcile", "unused", "check"],
+        default="reconcile",
+        nargs="?",
+    )
+    parsed = parser.parse_args()
+
+    if parsed.command == "reconcile":
+        reconcile()
+        try:
+            report_unused()
+        except PyMongoError as e:
+            print(f"Index usage unavailable: {e}")
+    elif parsed.command == "unused":
+        report_unused()
+    elif parsed.command == "check":
+        if check():
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import os
+
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client import start_http_server
+
+
+# EDDN listener
+eddn_messages = Counter(
+    "eddn_messages",
+    "EDDN messages by schema and stage: received, or decoded by a handler",
+    ["schema", "stage"],
+)
+eddn_reconnects = Counter(
+    "eddn_reconnects",
+    "Times the listener (re)connected to the relay",
+)
+eddn_timeouts = Counter(
+    "eddn_timeouts",
+    "Times the relay went quiet for too long and we reconnected",
+)
+eddn_errors = Counter(
+    "eddn_errors",
+    "ZMQ errors and undecodable messages",
+    ["kind"],
+)
+writer_queue_depth = Gauge(
+    "ingest_writer_queue_depth",
+    "Updates waiting in the coalescing writer's queue",
+)
+writer_dropped = Counter(
+    "ingest_writer_dropped",
+    "Updates dropped because the coalescing writer's queue was full",
+    ["schema"],
+)
+
+# Both writers
+operations_written = Counter(
+    "ingest_operations_written",
+    "Write operations applied, by collection and the schema they came from",
+    ["collection", "schema"],
+)
+bulk_write_operations = Histogram(
+    "ingest_bulk_write_operations",
+    "Operations per bulk write",
+    ["collection"],
+    buckets=(1, 5, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+)
+bulk_write_seconds = Histogram(
+    "ingest_bulk_write_seconds",
+    "Time taken by each bulk write",
+    ["collection"],
+)
+bulk_write_errors = Counter(
+    "ingest_bulk_write_errors",
+    "Bulk writes that failed",
+    ["collection"],
+)
+
+# Dump loader
+dump_entries = Counter(
+    "dump_entries",
+    "Dump entries processed, changed or skipped as unchanged",
+    ["result"],
+)
+dump_entries_per_second = Gauge(
+    "dump_entries_per_second",
+    "Dump entries processed per second over the last batch",
+)
+dump_offset_bytes = Gauge(
+    "dump_offset_bytes",
+    "Position in the decompressed dump being loaded",
+)
+dump_read_bytes = Gauge(
+    "dump_read_bytes",
+    "Compressed bytes of the dump read so far",
+)
+dump_size_bytes = Gauge(
+    "dump_size_bytes",
+    "Compressed size of the dump being loaded, if known",
+)
+dump_progress_ratio = Gauge(
+    "dump_progress_ratio",
+    "Fraction of the dump being loaded that has been read",
+)
+dump_last_load = Gauge(
+    "dump_last_load_timestamp_seconds",
+    "When the last dump load finished successfully",
+)
+
+
+def schema_label(schema_ref):
+    """Short form of an EDDN $schemaRef, e.g. "commodity/3"."""
+    return (schema_ref or "unknown").rsplit("/schemas/", 1)[-1]
+
+
+def observe_bulk_write(collection, written, seconds):
+    """Record a successful bulk write; `written` counts its ops by schema."""
+    bulk_write_operations.labels(collection.name).observe(
+        sum(written.values()),
+    )
+    bulk_write_seconds.labels(collection.name).observe(seconds)
+    for (schema, count) in written.items():
+        operations_written.labels(collection.name, schema).inc(count)
+
+
+def serve(default_port):
+    """Serve /metrics on METRICS_PORT (or `default_port`); 0 disables it."""
+    port = int(os.environ.get("METRICS_PORT", default_port))
+    if port:
+        start_http_server(port)
+        print(f"Serving metrics on port {port}")
@@ -1,35 +1,60 @@
 #!/usr/bin/env python
 
 
+import asyncio
 import datetime
 import itertools
 from typing import Dict
 from typing import List
 
+import numpy as np
 from fastapi import FastAPI
+from fastapi import Response
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import Gauge
+from prometheus_client import generate_latest
 from pydantic import BaseModel
-from cytoolz import topk as get_topk
+from pydantic import confloat
 from cytoolz import partition_all
+from cytoolz import assoc
 
+import commodity_prices
 import db
+import edsm_async
+import galaxy
+import indices
+import market_snapshot
+import result_cache
+from commodity_names import translations
+import timing
+from timing import span
+from result_cache import results
+from sale_model import revenue_expression
+from sale_model import sale_revenue
+from sale_model import split_sale
+from sphere_cache import spheres
 from edsm import systems_in_sphere_raw
-from edsm import location_raw
-from edsm import cargo_raw
 
 
 app = FastAPI()
 
+cache_stats = Gauge(
+    "sales_cache",
+    "Counters and sizes of the sphere cache, result cache and snapshot",
+    ["cache", "stat"],
+)
+
 
 def without_none(seq):
     return (x for x in seq if x is not None)
 
 
-def time_since(timestr):
-    try:
-        tm = datetime.datetime.strptime(timestr, "%Y-%m-%dT%H:%M:%S.%f%z")
-    except ValueError:
-        tm = datetime.datetime.strptime(timestr, "%Y-%m-%dT%H:%M:%S%z")
-    delta = datetime.datetime.now().astimezone() - tm
+def time_since(tm):
+    if isinstance(tm, str):
+        # Documents written before update_time became a native datetime
+        tm = datetime.datetime.fromisoformat(tm)
+    delta = datetime.datetime.now(datetime.timezone.utc) - tm
     return delta
 
 
@@ -40,19 +65,27 @@ def readable_time_since(delta):
     return f"{days}d {hours}h {minutes}m"
 
 
-def hypothetical_sale(cargo, market):
+def hypothetical_sale(cargo, market, cap_demand=True, elasticity=0.0):
     market_commodities = market.get("commodities", [])
     by_name = {c["name"]: c for c in market_commodities}
 
     matches = []
     for (name, quantity) in cargo.items():
         if name in by_name:
+            (sold, revenue) = sale_revenue(
+                by_name[name]["sellPrice"],
+                by_name[name]["demand"],
+                quantity,
+                cap_demand=cap_demand,
+                elasticity=elasticity,
+            )
             matches.append({
                 "name": name,
                 "sellPrice": by_name[name]["sellPrice"],
                 "demand": by_name[name]["demand"],
                 "quantity": quantity,
-                "revenue": by_name[name]["sellPrice"] * quantity,
+                "sold": int(sold),
+                "revenue": int(round(revenue)),
             })
 
     return {
@@ -65,6 +98,47 @@ def hypothetical_sale(cargo, market):
     }
 
 
+def sale_totals(cargo, markets, cap_demand=True, elasticity=0.0):
+    """`hypothetical_sale` totals for many markets at once.
+
+    Markets become rows of price and demand matrices over the cargo
+    commodities, with commodities a market doesn't list masked out, and the
+    cargo becomes a quantity vector broadcast across them.
+    """
+    names = list(cargo.keys())
+    columns = {name: j for (j, name) in enumerate(names)}
+    quantity = np.array([cargo[name] for name in names], dtype=np.int64)
+    price = np.zeros((len(markets), len(names)), dtype=np.int64)
+    demand = np.zeros((len(markets), len(names)), dtype=np.int64)
+    present = np.zeros((len(markets), len(names)), dtype=bool)
+    for (i, market) in enumerate(markets):
+        for c in market.get("commodities", []):
+            j = columns.get(c["name"])
+            if j is not None:
+                price[i, j] = c["sellPrice"]
+                demand[i, j] = c["demand"]
+                present[i, j] = True
+    (_, revenue) = sale_revenue(
+        price,
+        demand,
+        quantity,
+        cap_demand=cap_demand,
+        elasticity=elasticity,
+    )
+    return np.where(present, revenue, 0).sum(axis=1)
+
+
+def top_indices(totals, k):
+    """Indices of the `k` largest totals, largest first."""
+    if k <= 0:
+        return np.arange(0)
+    if len(totals) > k:
+        best = np.argpartition(-totals, k - 1)[:k]
+    else:
+        best = np.arange(len(totals))
+    return best[np.argsort(-totals[best], kind="stable")]
+
+
 def log(x, desc=None):
     if desc:
         print(f"{desc} {x}")
@@ -115,14 +189,7 @@ def filter_market(
         return None
 
     if disallowed_types:
-        station_data = db.strip_id(
-            db.station.find_one(
-                {
-                    "system": market["system"],
-                    "station": market["station"],
-                },
-            )
-        )
+        station_data = _station_data(market)
         if station_data is None:
             return None
 
@@ -133,43 +200,89 @@ def filter_market(
     return market
 
 
-def _translate_commodity(readable):
-    entry = db.commodity.find_one({"readable": readable})
-    if entry:
-        return entry["name"]
-    else:
-        return readable
+def translate_cargo(cargo):
+    return {
+        translations.translate(k): v
+        for (k, v) in cargo.items()
+    }
 
 
-@db.edsm_cache.memoize()
 def systems_in_sphere(location, radius=30):
-    return systems_in_sphere_raw(location, radius=radius)
+    # Use the local coordinate index when we can; EDSM is rate-limited and
+    # only needed for systems the index doesn't know about
+    local = galaxy.systems_in_sphere(location, radius=radius)
+    if local is not None:
+        return local
+    systems = spheres.get(location, radius)
+    if systems is None:
+        systems = systems_in_sphere_raw(location, radius=radius)
+        spheres.set(location, radius, systems)
+    return systems
+
+
+async def systems_in_sphere_async(location, radius=30):
+    local = await run_in_threadpool(
+        galaxy.systems_in_sphere,
+        location,
+        radius=radius,
+    )
+    if local is not None:
+        return local
+    systems = spheres.get(location, radius)
+    if systems is None:
+        systems = await edsm_async.systems_in_sphere_raw(
+            location,
+            radius=radius,
+        )
+        spheres.set(location, radius, systems)
+    return systems
 
 
-def _format_market(systems, market):
-    market_data = db.strip_id(
-        db.market.find_one(
-            {
-                "system": market["system"],
-                "station": market["station"],
-            },
-        )
-    )
-    if market_data is None:
-        return {
-            "system": market["system"],
-            "station": market["station"],
-            "source": "NO DATA",
-        }
+def _station_data(market):
+    # Markets coming through best_sell_stations already carry their station
+    # document; only go to the database for markets that weren't joined
+    if "station_data" in market:
+        return market["station_data"]
+    with span("station_lookup"):
+        return db.strip_id(db.station.find_one(_station_query(market)))
 
-    station_data = db.strip_id(
-        db.station.find_one(
-            {
-                "system": market["system"],
-                "station": market["station"],
-            },
+
+def _station_query(market):
+    return {"system": market["system"], "station": market["station"]}
+
+
+def _in_systems_query(system_names, query=None):
+    return {"system": {"$in": list(system_names)}, **(query or {})}
+
+
+def _find_in_systems(collection, system_names, query=None, batch_size=100):
+    return itertools.chain.from_iterable(
+        collection.find(
+            _in_systems_query(system_batch, query),
+            {"_id": 0},
         )
+        for system_batch in partition_all(batch_size, system_names)
     )
+
+
+def join_stations(markets, system_names):
+    """Attach each market's station document as `station_data`.
+
+    All the stations for the candidate systems are loaded up front, so
+    filtering and formatting don't need a round trip per market.
+    """
+    stations = {
+        (s["system"], s["station"]): s
+        for s in _find_in_systems(db.station, system_names)
+    }
+    return [
+        assoc(m, "station_data", stations.get((m["system"], m["station"])))
+        for m in markets
+    ]
+
+
+def _format_market(systems, market):
+    station_data = _station_data(market)
     if station_data is None:
         type_ = "NO DATA"
         sc_distance = "NO DATA"
@@ -182,23 +295,155 @@ def _format_market(systems, market):
         return {
             "system": system["name"],
             "jump_distance": system["distance"],
-            "station": market_data["station"],
+            "station": market["station"],
             "sc_distance": sc_distance,
             "type": type_,
             "updated": readable_time_since(
-                time_since(market_data["update_time"])
+                time_since(market["update_time"])
             ),
-            "source": market_data["source"],
+            "source": market["source"],
         }
     except KeyError:
         return {
             "system": system["name"],
-            "station": market_data["station"],
+            "station": market["station"],
             "source": "ERROR READING DB ENTRY",
         }
 
 
-def best_sell_stations(
+def _updated_after(max_update_seconds):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    earliest = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+    # Further back than datetime can go, so no market is too old
+    if max_update_seconds >= (now - earliest).total_seconds():
+        return earliest
+    return now - datetime.timedelta(seconds=max_update_seconds)
+
+
+def sales_pipeline(
+    system_names,
+    cargo,
+    min_price=1,
+    min_demand=1,
+    max_update_seconds=24*3600,
+    topk=20,
+    disallowed_types=None,
+    cap_demand=True,
+    elasticity=0.0,
+):
+    """Aggregation pipeline doing the work of filter_markets on the server.
+
+    Matches the Python path: a market qualifies if any cargo commodity meets
+    the price and demand floors, and its total is the `sale_revenue` over
+    every cargo commodity it buys.  Only the topk markets come back, carrying just
+    the cargo commodities and their joined `station_data`.
+    """
+    names = list(cargo.keys())
+    quantity = {
+        "$switch": {
+            "branches": [
+                {
+                    "case": {"$eq": ["$$c.name", {"$literal": name}]},
+                    "then": qty,
+                }
+                for (name, qty) in cargo.items()
+            ],
+            "default": 0,
+        },
+    }
+    lookup = [
+        {
+            "$lookup": {
+                "from": db.station.name,
+                "localField": "system",
+                "foreignField": "system",
+                "as": "station_data",
+            },
+        },
+        {
+            "$addFields": {
+                "station_data": {
+                    "$arrayElemAt": [
+                        {
+                            "$filter": {
+                                "input": "$station_data",
+                                "as": "s",
+                                "cond": {"$eq": ["$$s.station", "$station"]},
+                            },
+                        },
+                        0,
+                    ],
+                },
+            },
+        },
+    ]
+
+    pipeline = [
+        {
+            "$match": {
+                "system": {"$in": list(system_names)},
+                "update_time": {"$gt": _updated_after(max_update_seconds)},
+                "commodities": {
+                    "$elemMatch": {
+                        "name": {"$in": names},
+                        "sellPrice": {"$gte": min_price},
+                        "demand": {"$gte": min_demand},
+                    },
+                },
+            },
+        },
+        {
+            "$addFields": {
+                "commodities": {
+                    "$filter": {
+                        "input": "$commodities",
+                        "as": "c",
+                        "cond": {"$in": ["$$c.name", names]},
+                    },
+                },
+            },
+        },
+        {
+            "$addFields": {
+                "total": {
+                    "$sum": {
+                        "$map": {
+                            "input": "$commodities",
+                            "as": "c",
+                            "in": revenue_expression(
+                                "$$c.sellPrice",
+                                "$$c.demand",
+                                quantity,
+                                cap_demand=cap_demand,
+                                elasticity=elasticity,
+                            ),
+                        },
+                    },
+                },
+            },
+        },
+    ]
+    if disallowed_types:
+        # Type filtering has to see every candidate, so join before limiting
+        pipeline.extend(lookup)
+        pipeline.append(
+            {
+                "$match": {
+                    "station_data": {"$exists": True},
+                    "station_data.type": {"$nin": list(disallowed_types)},
+                },
+            }
+        )
+        pipeline.extend([{"$sort": {"total": -1}}, {"$limit": topk}])
+    else:
+        # Otherwise only the winners need their station joined
+        pipeline.extend([{"$sort": {"total": -1}}, {"$limit": topk}])
+        pipeline.extend(lookup)
+    pipeline.append({"$project": {"_id": 0, "station_data._id": 0}})
+    return pipeline
+
+
+def rank_markets(
     system,
     cargo,
     radius=30,
@@ -207,57 +452,221 @@ def best_sell_stations(
     max_update_seconds=24*3600,
     topk=20,
     disallowed_types=None,
+    server_side=True,
+    systems=None,
+    cap_demand=True,
+    elasticity=0.0,
 ):
-    cargo = {
-        _translate_commodity(k): v
-        for (k, v) in cargo.items()
-    }
+    """The `topk` markets around `system` by revenue for `cargo`, best first.
+
+    `cargo` is keyed by commodity name, as `translate_cargo` returns it.
+    Returns the sphere systems by name and the ranked markets.
+    """
+    if not cargo:
+        # Nothing to sell (an empty hold), and Mongo rejects a $switch with
+        # no branches
+        return ({}, [])
     commodities = list(cargo.keys())
 
-    systems = systems_in_sphere(system, radius=radius)
+    if systems is None:
+        with span("sphere"):
+            systems = systems_in_sphere(system, radius=radius)
     system_data = {system["name"]: system for system in systems}
 
-    batch_size = 100
-    markets = itertools.chain.from_iterable(
-        db.market.find({"system": {"$in": system_batch}})
-        for system_batch in partition_all(batch_size, systems)
-    )
+    # With the snapshot, everything we need is already in memory
+    in_memory = market_snapshot.active()
+
+    candidates = list(system_data.keys())
+    if not in_memory and commodity_prices.is_backfilled():
+        # Only visit systems with a market that buys some of the cargo
+        with span("candidates"):
+            candidates = commodity_prices.candidate_systems(
+                commodities,
+                candidates,
+                min_price=min_price,
+                min_demand=min_demand,
+                updated_after=_updated_after(max_update_seconds),
+            )
 
-    filtered = filter_markets(
-        markets,
-        commodities,
-        min_price=min_price,
-        min_demand=min_demand,
-        max_update_seconds=max_update_seconds,
-        disallowed_types=disallowed_types,
-    )
-    sales = [hypothetical_sale(cargo, n) for n in filtered]
-    pre_sort = [
-        {
-            "sale": sale,
-            "market": _format_market(system_data, mkt),
-        }
-        for (sale, mkt) in zip(sales, filtered)
-    ]
-    sales_sorted = get_topk(
-        topk,
-        pre_sort,
-        key=lambda x: x["sale"]["total"],
+    if in_memory:
+        with span("snapshot"):
+            filtered = market_snapshot.snapshot.markets(
+                system_data.keys(),
+                commodities,
+                min_price=min_price,
+                min_demand=min_demand,
+                updated_after=_updated_after(max_update_seconds),
+                disallowed_types=disallowed_types,
+            )
+    elif server_side:
+        with span("aggregate"):
+            filtered = list(
+                db.market.aggregate(
+                    sales_pipeline(
+                        candidates,
+                        cargo,
+                        min_price=min_price,
+                        min_demand=min_demand,
+                        max_update_seconds=max_update_seconds,
+                        topk=topk,
+                        disallowed_types=disallowed_types,
+                        cap_demand=cap_demand,
+                        elasticity=elasticity,
+                    )
+                )
+            )
+    else:
+        # Reference implementation: fetch whole markets and filter in Python
+        with span("markets"):
+            markets = join_stations(
+                _find_in_systems(
+                    db.market,
+                    candidates,
+                    query={
+                        "update_time": {
+                            "$gt": _updated_after(max_update_seconds),
+                        },
+                    },
+                ),
+                candidates,
+            )
+        with span("filter"):
+            filtered = filter_markets(
+                markets,
+                commodities,
+                min_price=min_price,
+                min_demand=min_demand,
+                max_update_seconds=max_update_seconds,
+                disallowed_types=disallowed_types,
+            )
+
+    # Rank everything at once, then only detail and format the winners
+    with span("rank"):
+        totals = sale_totals(
+            cargo,
+            filtered,
+            cap_demand=cap_demand,
+            elasticity=elasticity,
+        )
+        ranked = [filtered[i] for i in top_indices(totals, topk)]
+    return (system_data, ranked)
+
+
+def best_sell_stations(
+    system,
+    cargo,
+    cap_demand=True,
+    elasticity=0.0,
+    **kwargs,
+):
+    (system_data, ranked) = rank_markets(
+        system,
+        cargo,
+        cap_demand=cap_demand,
+        elasticity=elasticity,
+        **kwargs,
     )
+    with span("format"):
+        sales_sorted = [
+            {
+                "sale": hypothetical_sale(
+                    cargo,
+                    market,
+                    cap_demand=cap_demand,
+                    elasticity=elasticity,
+                ),
+                "market": _format_market(system_data, market),
+            }
+            for market in ranked
+        ]
     return sales_sorted
 
 
-def commander_info(name, api_key):
-    location = location_raw(name, api_key)
-    cargo_ = cargo_raw(name, api_key)
-    system = location["system"]
-    cargo = {c["name"]: c["qty"] for c in cargo_["cargo"] if c["qty"]}
+def best_split_sale(
+    system,
+    cargo,
+    hops=3,
+    cap_demand=True,
+    elasticity=0.0,
+    **kwargs,
+):
+    """Best way to sell `cargo` over at most `hops` of the top markets."""
+    (system_data, ranked) = rank_markets(
+        system,
+        cargo,
+        cap_demand=cap_demand,
+        elasticity=elasticity,
+        **kwargs,
+    )
+    with span("split"):
+        (stops, unsold) = split_sale(
+            cargo,
+            ranked,
+            hops=hops,
+            cap_demand=cap_demand,
+            elasticity=elasticity,
+        )
+    with span("format"):
+        formatted = []
+        for (i, sales) in stops:
+            prices = {c["name"]: c for c in ranked[i]["commodities"]}
+            matched = [
+                {
+                    "name": name,
+                    "sellPrice": prices[name]["sellPrice"],
+                    "demand": prices[name]["demand"],
+                    "sold": sold,
+                    "revenue": revenue,
+                }
+                for (name, (sold, revenue)) in sales.items()
+            ]
+            formatted.append({
+                "sale": {
+                    "total": sum(m["revenue"] for m in matched),
+                    "matched": sorted(
+                        matched,
+                        key=lambda x: x["sellPrice"],
+                        reverse=True,
+                    ),
+                },
+                "market": _format_market(system_data, ranked[i]),
+            })
     return {
-        "system": system,
-        "cargo": cargo,
+        "total": sum(stop["sale"]["total"] for stop in formatted),
+        "stops": formatted,
+        "unsold": unsold,
     }
 
 
+def cached_search(search, system, cargo, systems, **kwargs):
+    """Call `search` unless the result cache has a current answer.
+
+    Requests are keyed on the translated cargo and the search parameters,
+    and the answer is reused until a market in one of `systems` changes.
+    """
+    with span("translate"):
+        cargo = translate_cargo(cargo)
+    if results.max_entries <= 0:
+        return search(system, cargo, systems=systems, **kwargs)
+    with span("result_cache"):
+        key = result_cache.request_key(
+            search=search.__name__,
+            system=system.lower(),
+            cargo=cargo,
+            **kwargs,
+        )
+        versions = result_cache.system_versions(s["name"] for s in systems)
+        found = results.get(key, versions)
+    if found is None:
+        found = search(system, cargo, systems=systems, **kwargs)
+        results.set(key, versions, found)
+    return found
+
+
+def _cargo_from_raw(cargo_):
+    return {c["name"]: c["qty"] for c in cargo_["cargo"] if c["qty"]}
+
+
 class SellStationRequest(BaseModel):
     commander: str = None
     api_key: str = None
@@ -269,6 +678,18 @@ class SellStationRequest(BaseModel):
     omit_station_types: List[str] = ["Fleet Carrier", "Odyssey Settlement"]
     cargo: Dict[str, int] = None
     topk: int = 20
+    server_side: bool = True
+    cap_demand: bool = True
+    # Fraction the price falls by as demand fills; above 1 it goes negative
+    elasticity: confloat(ge=0, le=1) = 0.0
+    # Include per-stage times and Mongo command counts in the response
+    timings: bool = False
+
+
+class SplitSaleRequest(SellStationRequest):
+    # Candidates to spread the cargo over, not stations returned
+    topk: int = 100
+    hops: int = 3
 
 
 @app.get("/")
@@ -277,24 +698,148 @@ def _():
     return {"ok": True, "api_docs": "/docs"}
 
 
-@app.post("/sales")
-def _sales(request: SellStationRequest):
-    if request.system and request.cargo:
+@app.get("/sphere_cache")
+def _sphere_cache():
+    """Hit, miss and eviction counts for the EDSM sphere cache."""
+    return spheres.stats()
+
+
+@app.get("/result_cache")
+def _result_cache():
+    """Hit, miss and invalidation counts for the /sales response cache."""
+    return results.stats()
+
+
+@app.get("/snapshot")
+def _snapshot():
+    """Size and refresh lag of the in-memory market snapshot."""
+    return {
+        "enabled": market_snapshot.enabled,
+        **market_snapshot.snapshot.stats(),
+    }
+
+
+@app.get("/metrics")
+def _metrics():
+    """Stage timings, Mongo commands and cache stats for Prometheus."""
+    caches = {
+        "sphere": spheres.stats(),
+        "result": results.stats(),
+        "snapshot": market_snapshot.snapshot.stats(),
+    }
+    for (cache, stats) in caches.items():
+        for (stat, value) in stats.items():
+            if isinstance(value, (bool, int, float)):
+                cache_stats.labels(cache, stat).set(value)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.on_event("startup")
+def _reconcile_indices():
+    # Every deploy restarts the API, so this keeps the indices current
+    indices.reconcile()
+
+
+@app.on_event("startup")
+def _load_commodity_names():
+    translations.refresh()
+
+
+@app.on_event("startup")
+def _start_snapshot():
+    if market_snapshot.enabled:
+        market_snapshot.start()
+
+
+@app.on_event("shutdown")
+async def _close_edsm():
+    await edsm_async.close()
+
+
+async def _resolve(request):
+    """The commander's system, the systems around it, and the cargo."""
+    # The cargo lookup doesn't depend on where the commander is, so it runs
+    # alongside the location -> sphere chain
+    async def locate():
         system = request.system
-        cargo = request.cargo
-    else:
-        data = commander_info(request.commander, request.api_key)
-        system = request.system or data["system"]
-        cargo = request.cargo or data["cargo"]
+        if not system:
+            with span("location"):
+                location = await edsm_async.location_raw(
+                    request.commander,
+                    request.api_key,
+                )
+            system = location["system"]
+        with span("sphere"):
+            systems = await systems_in_sphere_async(
+                system,
+                radius=request.radius,
+            )
+        return (system, systems)
+
+    async def fetch_cargo():
+        if request.cargo:
+            return request.cargo
+        with span("cargo"):
+            cargo_ = await edsm_async.cargo_raw(
+                request.commander,
+                request.api_key,
+            )
+        return _cargo_from_raw(cargo_)
 
-    best = best_sell_stations(
-        system,
-        cargo,
-        radius=request.radius,
-        min_price=request.min_price,
-        min_demand=request.min_demand,
-        max_update_seconds=request.max_update_seconds,
-        topk=request.topk,
-        disallowed_types=request.omit_station_types,
+    ((system, systems), cargo) = await asyncio.gather(
+        locate(),
+        fetch_cargo(),
     )
+    return (system, systems, cargo)
+
+
+def _search_args(request):
+    return {
+        "radius": request.radius,
+        "min_price": request.min_price,
+        "min_demand": request.min_demand,
+        "max_update_seconds": request.max_update_seconds,
+        "topk": request.topk,
+        "disallowed_types": request.omit_station_types,
+        "server_side": request.server_side,
+        "cap_demand": request.cap_demand,
+        "elasticity": request.elasticity,
+    }
+
+
+@app.post("/sales")
+async def _sales(request: SellStationRequest):
+    with timing.collect() as timings:
+        with span("total"):
+            (system, systems, cargo) = await _resolve(request)
+            best = await run_in_threadpool(
+                cached_search,
+                best_sell_stations,
+                system,
+                cargo,
+                systems,
+                **_search_args(request),
+            )
+    if request.timings:
+        return {"sales": best, "timings": timings.as_dict()}
     return best
+
+
+@app.post("/split_sales")
+async def _split_sales(request: SplitSaleRequest):
+    """Spread the cargo over up to `hops` stations when no one buys it all."""
+    with timing.collect() as timings:
+        with span("total"):
+            (system, systems, cargo) = await _resolve(request)
+            split = await run_in_threadpool(
+                cached_search,
+                best_split_sale,
+                system,
+                cargo,
+                systems,
+                hops=request.hops,
+                **_search_args(request),
+            )
+    if request.timings:
+        return {**split, "timings": timings.as_dict()}
+    return split
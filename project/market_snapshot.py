@@ -0,0 +1,323 @@
+import datetime
+import os
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from pymongo.errors import PyMongoError
+
+import db
+
+
+enabled = bool(os.environ.get("MARKET_SNAPSHOT"))
+# Used when the deployment doesn't support change streams
+poll_seconds = float(os.environ.get("MARKET_SNAPSHOT_POLL_SECONDS", 10))
+station_reload_seconds = float(
+    os.environ.get("MARKET_SNAPSHOT_STATION_SECONDS", 600)
+)
+# Polls look for markets written since the newest `written_at` seen, less
+# this much, since concurrent writers don't commit in timestamp order
+poll_overlap = datetime.timedelta(seconds=60)
+
+
+def _timestamp(update_time):
+    if update_time is None:
+        return -np.inf
+    if isinstance(update_time, str):
+        update_time = datetime.datetime.fromisoformat(update_time)
+    return update_time.timestamp()
+
+
+class MarketSnapshot:
+    """Compact in-memory copy of every market, for answering /sales.
+
+    Prices and demands live in (market, commodity) arrays; `present` marks
+    which commodities each market lists.  Mongo remains the source of
+    truth: the snapshot is loaded from it and kept current by `run`.
+    """
+
+    def __init__(self, rows=1024, commodities=64):
+        self.lock = threading.Lock()
+        self.commodity_ids = {}
+        self.commodity_names = []
+        self.rows = {}
+        self.rows_by_id = {}
+        self.rows_by_system = defaultdict(list)
+        self.keys = []
+        self.sources = []
+        self.station_data = []
+        self.stations = {}
+        self.price = np.zeros((rows, commodities), dtype=np.int32)
+        self.demand = np.zeros((rows, commodities), dtype=np.int32)
+        self.present = np.zeros((rows, commodities), dtype=bool)
+        self.update_time = np.full(rows, -np.inf)
+        self.ready = False
+        self.high_water = None
+        self.refreshed_at = None
+        self.mode = None
+
+    def _grow(self, rows, columns):
+        (have_rows, have_columns) = self.price.shape
+        if rows <= have_rows and columns <= have_columns:
+            return
+        new_rows = max(have_rows, rows if rows <= have_rows else 2 * rows)
+        new_columns = max(
+            have_columns,
+            columns if columns <= have_columns else 2 * columns,
+        )
+        for name in ("price", "demand", "present"):
+            old = getattr(self, name)
+            new = np.zeros((new_rows, new_columns), dtype=old.dtype)
+            new[:have_rows, :have_columns] = old
+            setattr(self, name, new)
+        update_time = np.full(new_rows, -np.inf)
+        update_time[:have_rows] = self.update_time
+        self.update_time = update_time
+
+    def _column(self, name):
+        column = self.commodity_ids.get(name)
+        if column is None:
+            column = len(self.commodity_names)
+            self.commodity_ids[name] = column
+            self.commodity_names.append(name)
+        return column
+
+    def upsert(self, market):
+        key = (market["system"], market["station"])
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            self.rows[key] = row
+            self.rows_by_system[key[0]].append(row)
+            self.keys.append(key)
+            self.sources.append(None)
+            self.station_data.append(self.stations.get(key))
+
+        commodities = market.get("commodities", [])
+        columns = [self._column(c["name"]) for c in commodities]
+        self._grow(row + 1, len(self.commodity_names))
+
+        self.present[row] = False
+        self.price[row] = 0
+        self.demand[row] = 0
+        if columns:
+            self.present[row, columns] = True
+            self.price[row, columns] = [c["sellPrice"] for c in commodities]
+            self.demand[row, columns] = [c["demand"] for c in commodities]
+        self.update_time[row] = _timestamp(market.get("update_time"))
+        self.sources[row] = market.get("source")
+        if "_id" in market:
+            self.rows_by_id[market["_id"]] = row
+
+    def remove(self, _id):
+        row = self.rows_by_id.pop(_id, None)
+        if row is not None:
+            # Keep the row, just make sure it can never match again
+            self.present[row] = False
+            self.update_time[row] = -np.inf
+
+    def set_stations(self, stations):
+        self.stations = {(s["system"], s["station"]): s for s in stations}
+        self.station_data = [self.stations.get(key) for key in self.keys]
+
+    def load(self):
+        started = datetime.datetime.now(datetime.timezone.utc)
+        stations = list(db.station.find({}, {"_id": 0}))
+        with self.lock:
+            self.set_stations(stations)
+        for market in db.market.find({}):
+            with self.lock:
+                self.upsert(market)
+                self._advance(market.get("written_at"))
+        if self.high_water is None:
+            # Nothing has been stamped yet; anything written from now on is
+            self.high_water = started
+        self.ready = True
+        self.refreshed_at = time.time()
+
+    def _advance(self, written_at):
+        if written_at is not None:
+            if self.high_water is None or written_at > self.high_water:
+                self.high_water = written_at
+
+    def poll(self):
+        """Pick up markets written since the last poll.
+
+        Every market write stamps `written_at`, whatever the market's own
+        `update_time` (dump markets are often hours old when loaded).
+        """
+        query = {"written_at": {"$gt": self.high_water - poll_overlap}}
+        for market in db.market.find(query):
+            with self.lock:
+                self.upsert(market)
+                self._advance(market.get("written_at"))
+        self.refreshed_at = time.time()
+
+    def remove_deleted(self):
+        """Drop rows for deleted markets, which polls don't otherwise see."""
+        ids = {m["_id"] for m in db.market.find({}, {"_id": 1})}
+        with self.lock:
+            for _id in list(self.rows_by_id):
+                if _id not in ids:
+                    self.remove(_id)
+
+    def reload_stations(self):
+        stations = list(db.station.find({}, {"_id": 0}))
+        with self.lock:
+            self.set_stations(stations)
+
+    def _watch(self, stream):
+        self.mode = "change-stream"
+        last_stations = time.time()
+        while True:
+            change = stream.try_next()
+            if change is not None:
+                if change["operationType"] == "delete":
+                    with self.lock:
+                        self.remove(change["documentKey"]["_id"])
+                elif change.get("fullDocument") is not None:
+                    with self.lock:
+                        self.upsert(change["fullDocument"])
+            self.refreshed_at = time.time()
+            if time.time() - last_stations > station_reload_seconds:
+                self.reload_stations()
+                last_stations = time.time()
+
+    def _poll_forever(self):
+        self.mode = "poll"
+        last_stations = time.time()
+        while True:
+            time.sleep(poll_seconds)
+            try:
+                self.poll()
+                if time.time() - last_stations > station_reload_seconds:
+                    self.reload_stations()
+                    self.remove_deleted()
+                    last_stations = time.time()
+            except PyMongoError as e:
+                print(f"Market snapshot refresh failed: {e}")
+
+    def run(self):
+        try:
+            # Open the stream before loading so no change falls in between
+            stream = db.market.watch(
+                full_document="updateLookup",
+                max_await_time_ms=1000,
+            )
+        except PyMongoError as e:
+            # Change streams need a replica set; fall back to polling
+            print(f"Market snapshot change stream unavailable ({e}), polling")
+            stream = None
+
+        self.load()
+        print(f"Market snapshot loaded: {self.stats()}")
+        if stream is not None:
+            try:
+                with stream:
+                    self._watch(stream)
+            except PyMongoError as e:
+                print(f"Market snapshot change stream failed ({e}), polling")
+        self._poll_forever()
+
+    def markets(
+        self,
+        system_names,
+        commodities,
+        min_price=1,
+        min_demand=1,
+        updated_after=None,
+        disallowed_types=None,
+    ):
+        """Markets that pass `filter_market`, shaped like market documents.
+
+        Each market only lists the cargo commodities it buys.
+        """
+        with self.lock:
+            rows = np.array(
+                [
+                    row
+                    for system in system_names
+                    for row in self.rows_by_system.get(system, ())
+                ],
+                dtype=np.int64,
+            )
+            columns = np.array(
+                [
+                    self.commodity_ids[c] for c in commodities
+                    if c in self.commodity_ids
+                ],
+                dtype=np.int64,
+            )
+            if not len(rows) or not len(columns):
+                return []
+
+            present = self.present[np.ix_(rows, columns)]
+            price = self.price[np.ix_(rows, columns)]
+            demand = self.demand[np.ix_(rows, columns)]
+            ok = (present & (price >= min_price) & (demand >= min_demand)).any(
+                axis=1
+            )
+            if updated_after is not None:
+                ok &= self.update_time[rows] > updated_after.timestamp()
+
+            found = []
+            for i in np.flatnonzero(ok):
+                row = rows[i]
+                station_data = self.station_data[row]
+                if disallowed_types and (
+                    station_data is None or
+                    station_data["type"] in disallowed_types
+                ):
+                    continue
+                (system, station) = self.keys[row]
+                found.append({
+                    "system": system,
+                    "station": station,
+                    "update_time": datetime.datetime.fromtimestamp(
+                        self.update_time[row],
+                        datetime.timezone.utc,
+                    ),
+                    "source": self.sources[row],
+                    "commodities": [
+                        {
+                            "name": self.commodity_names[column],
+                            "sellPrice": int(price[i, j]),
+                            "demand": int(demand[i, j]),
+                        }
+                        for (j, column) in enumerate(columns)
+                        if present[i, j]
+                    ],
+                    "station_data": station_data,
+                })
+            return found
+
+    def stats(self):
+        array_bytes = sum(
+            a.nbytes
+            for a in (self.price, self.demand, self.present, self.update_time)
+        )
+        return {
+            "ready": self.ready,
+            "mode": self.mode,
+            "markets": len(self.keys),
+            "commodities": len(self.commodity_names),
+            "array_bytes": array_bytes,
+            "refresh_lag_seconds": (
+                None if self.refreshed_at is None
+                else round(time.time() - self.refreshed_at, 3)
+            ),
+        }
+
+
+snapshot = MarketSnapshot()
+
+
+def start():
+    thread = threading.Thread(target=snapshot.run, daemon=True)
+    thread.start()
+    return thread
+
+
+def active():
+    return enabled and snapshot.ready
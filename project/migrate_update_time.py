@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+
+import datetime
+
+from cytoolz import partition_all
+from pymongo import UpdateOne
+
+import db
+
+
+def convert(doc):
+    return UpdateOne(
+        {"_id": doc["_id"], "update_time": doc["update_time"]},
+        {
+            "$set": {
+                "update_time": datetime.datetime.fromisoformat(
+                    doc["update_time"]
+                ),
+            },
+        },
+    )
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    parsed = parser.parse_args()
+
+    legacy = {"update_time": {"$type": "string"}}
+    print(f"{db.market.count_documents(legacy)} markets to migrate")
+    if parsed.dry_run:
+        return
+
+    # Matching on the old value means a market rewritten by the listener
+    # while we run is left alone rather than clobbered
+    docs = db.market.find(legacy, {"_id": 1, "update_time": 1})
+    migrated = 0
+    for batch in partition_all(parsed.batch_size, docs):
+        result = db.market.bulk_write(
+            [convert(doc) for doc in batch],
+            ordered=False,
+        )
+        migrated += result.modified_count
+        print(f"Migrated {migrated} markets")
+
+    print(f"{db.market.count_documents(legacy)} markets left unmigrated")
+
+
+if __name__ == "__main__":
+    main()
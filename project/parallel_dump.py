@@ -0,0 +1,290 @@
+import multiprocessing
+import queue
+import time
+from collections import Counter
+
+import db
+import ingest_metrics
+import result_cache
+import station_dump
+from conversion import from_edsm
+from dump_reader import Progress
+from dump_reader import parse_line
+from dump_reader import read_line_chunks
+
+
+# Collections the dump writes to, by full name.  Operations are tagged with
+# these to cross process boundaries, since collections can't be pickled.
+_collections = {
+    c.full_name: c
+    for c in (db.commodity, db.station, db.market, db.commodity_prices)
+}
+
+
+def shard(key, shards):
+    """Which of `shards` writers owns `key`, the same in every process."""
+    return station_dump.key_hash(key) % shards
+
+
+def _read(source, offset, lines, chunks, progress_queue, workers):
+    progress = Progress()
+    count = 0
+    for (end, chunk) in read_line_chunks(
+        source,
+        offset=offset,
+        lines=lines,
+        progress=progress,
+    ):
+        chunks.put((count, chunk))
+        progress_queue.put(("read", count, end, progress.read, progress.total))
+        count += 1
+    for _ in range(workers):
+        chunks.put(None)
+    progress_queue.put(("done", count))
+
+
+def _convert(chunks, writer_queues):
+    commodity_names = station_dump.known_commodity_names()
+    while True:
+        task = chunks.get()
+        if task is None:
+            break
+        (seq, lines) = task
+        # (key, digest, operations) for each writer.  New commodity names
+        # aren't tied to a station and are harmless to write twice, so they
+        # go to the first writer with no key.
+        shards = [[] for _ in writer_queues]
+        for line in lines:
+            data = parse_line(line)
+            if data is None:
+                continue
+            converted = from_edsm(data)
+            fingerprint = station_dump.digest(converted)
+            key = (converted["system"], converted["station"])
+            operations = []
+            for (collection, operation) in station_dump.operations(
+                converted,
+                commodity_names,
+            ):
+                if collection is db.commodity:
+                    shards[0].append(
+                        (None, None, [(collection.full_name, operation)]),
+                    )
+                else:
+                    operations.append((collection.full_name, operation))
+            shards[shard(key, len(shards))].append(
+                (key, fingerprint, operations),
+            )
+        # Every writer hears about every chunk, so it can acknowledge it
+        for (items, writer_queue) in zip(shards, writer_queues):
+            writer_queue.put((seq, items))
+    for writer_queue in writer_queues:
+        writer_queue.put(None)
+
+
+def _write(index, writers, workers, items, progress_queue, eddn_owned):
+    digests = station_dump.load_digests(shard=(index, writers))
+    # Chunk each station was last written from.  Workers finish chunks out
+    # of order, so an older entry for a station arriving late is dropped.
+    written_in = {}
+    # The dump leaves markets EDDN owns, and their prices, alone
+    market_names = {db.market.full_name, db.commodity_prices.full_name}
+    finished = 0
+    while finished < workers:
+        task = items.get()
+        if task is None:
+            finished += 1
+            continue
+        (seq, entries) = task
+        by_collection = {}
+        changed = 0
+        skipped = 0
+        touched = set()
+        new_digests = {}
+        # Both versions of a station listed twice in one chunk would go into
+        # the same unordered bulk write, so only the last one is kept
+        last = {
+            key: i
+            for (i, (key, _, _)) in enumerate(entries)
+            if key is not None
+        }
+        for (i, (key, fingerprint, operations)) in enumerate(entries):
+            if key is not None:
+                if last[key] != i or written_in.get(key, -1) > seq:
+                    skipped += 1
+                    continue
+                # Even when unchanged, so an older entry can't follow it
+                written_in[key] = seq
+                if digests.get(key) == fingerprint:
+                    skipped += 1
+                    continue
+                digests[key] = fingerprint
+                new_digests[key] = fingerprint
+                changed += 1
+                touched.add(key[0])
+            for (name, operation) in operations:
+                if name in market_names and key in eddn_owned:
+                    continue
+                by_collection.setdefault(name, []).append(operation)
+
+        writes = []
+        for (name, operations) in by_collection.items():
+            start = time.perf_counter()
+            _collections[name].bulk_write(operations, ordered=False)
+            writes.append((name, len(operations), time.perf_counter() - start))
+        # Only now that the station's other writes have landed
+        station_dump.save_digests(new_digests)
+        result_cache.bump(touched)
+        progress_queue.put(("written", seq, changed, skipped, writes))
+
+
+def _check(processes):
+    for process in processes:
+        if process.exitcode not in (None, 0):
+            raise RuntimeError(
+                f"{process.name} exited with {process.exitcode}"
+            )
+
+
+def load(
+    source,
+    offset=0,
+    checkpoint=None,
+    progress=None,
+    workers=4,
+    writers=4,
+    lines=1000,
+):
+    """Load a dump like `station_dump.load_dump`, using several processes.
+
+    A reader process splits the decompressed dump into chunks of `lines`
+    lines, `workers` processes convert them into write operations, and
+    `writers` processes apply those.  Each station belongs to one writer,
+    so writes for a station are applied in dump order.  Every queue between
+    them is bounded, so a slow stage holds the earlier ones back instead of
+    letting memory grow.
+
+    `checkpoint` is called with the offset to resume from once everything
+    before it has been written.  Returns how many stations were changed and
+    how many were skipped as unchanged.
+    """
+    context = multiprocessing.get_context("spawn")
+    chunks = context.Queue(maxsize=2 * workers)
+    writer_queues = [
+        context.Queue(maxsize=2 * workers)
+        for _ in range(writers)
+    ]
+    progress_queue = context.Queue()
+    known_names = station_dump.known_commodity_names()
+    eddn_owned = station_dump.eddn_markets()
+
+    processes = [
+        context.Process(
+            target=_read,
+            args=(source, offset, lines, chunks, progress_queue, workers),
+            name="dump-reader",
+        ),
+    ]
+    processes.extend(
+        context.Process(
+            target=_convert,
+            args=(chunks, writer_queues),
+            name=f"dump-worker-{i}",
+        )
+        for i in range(workers)
+    )
+    processes.extend(
+        context.Process(
+            target=_write,
+            args=(
+                i,
+                writers,
+                workers,
+                writer_queue,
+                progress_queue,
+                {key for key in eddn_owned if shard(key, writers) == i},
+            ),
+            name=f"dump-writer-{i}",
+        )
+        for (i, writer_queue) in enumerate(writer_queues)
+    )
+
+    # Offsets of chunks read, and how many writers are done with each
+    ends = {}
+    acknowledged = Counter()
+    # Chunks before this one are written by every writer
+    done = 0
+    total = None
+    changed = 0
+    skipped = 0
+    batch_started = time.monotonic()
+    batch_entries = 0
+    for process in processes:
+        process.start()
+    try:
+        while total is None or done < total:
+            try:
+                message = progress_queue.get(timeout=1)
+            except queue.Empty:
+                _check(processes)
+                continue
+
+            if message[0] == "read":
+                (_, seq, end, read, size) = message
+                ends[seq] = end
+                if progress is not None:
+                    progress.read = read
+                    progress.total = size
+            elif message[0] == "done":
+                total = message[1]
+            elif message[0] == "written":
+                (_, seq, chunk_changed, chunk_skipped, writes) = message
+                acknowledged[seq] += 1
+                changed += chunk_changed
+                skipped += chunk_skipped
+                batch_entries += chunk_changed + chunk_skipped
+                ingest_metrics.dump_entries.labels("changed").inc(
+                    chunk_changed,
+                )
+                ingest_metrics.dump_entries.labels("skipped").inc(
+                    chunk_skipped,
+                )
+                for (name, count, seconds) in writes:
+                    ingest_metrics.observe_bulk_write(
+                        _collections[name],
+                        {"edsm-dump": count},
+                        seconds,
+                    )
+
+            resume_from = None
+            while acknowledged[done] == writers and done in ends:
+                del acknowledged[done]
+                resume_from = ends.pop(done)
+                done += 1
+            if resume_from is not None:
+                now = time.monotonic()
+                ingest_metrics.dump_entries_per_second.set(
+                    batch_entries / max(now - batch_started, 1e-6),
+                )
+                ingest_metrics.dump_offset_bytes.set(resume_from)
+                batch_started = now
+                batch_entries = 0
+                if checkpoint:
+                    checkpoint(resume_from)
+                print(
+                    f"Saved {changed + skipped} stations "
+                    f"({resume_from} bytes, {skipped} unchanged)"
+                )
+
+        for process in processes:
+            process.join()
+        _check(processes)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    if station_dump.known_commodity_names() != known_names:
+        station_dump.commodities_changed()
+    return {"changed": changed, "skipped": skipped}
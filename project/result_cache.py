@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cytoolz import partition_all
+from pymongo import UpdateOne
+
+import db
+
+
+# Number of /sales responses kept; 0 disables the cache
+max_entries = int(os.environ.get("RESULT_CACHE_ENTRIES", 1024))
+# Market ages in the responses and the max_update_seconds cutoff drift with
+# the clock, so even unchanged markets are only reused this long
+ttl = float(os.environ.get("RESULT_CACHE_TTL", 60))
+
+
+def bump_operation(system):
+    """Write marking every cached response covering `system` as stale."""
+    return UpdateOne(
+        {"system": system},
+        {"$inc": {"version": 1}},
+        upsert=True,
+    )
+
+
+def bump(system_names, batch_size=1000):
+    for batch in partition_all(batch_size, system_names):
+        db.system_versions.bulk_write(
+            [bump_operation(system) for system in batch],
+            ordered=False,
+        )
+
+
+def system_versions(system_names, batch_size=1000):
+    """Current version of each system in `system_names` that has one."""
+    return {
+        v["system"]: v["version"]
+        for batch in partition_all(batch_size, system_names)
+        for v in db.system_versions.find(
+            {"system": {"$in": list(batch)}},
+            {"_id": 0, "system": 1, "version": 1},
+        )
+    }
+
+
+def request_key(**query):
+    """Canonical hash of a normalized query."""
+    serialized = json.dumps(query, sort_keys=True, default=str)
+    hashed = hashlib.blake2b(serialized.encode("utf-8"), digest_size=16)
+    return hashed.hexdigest()
+
+
+class ResultCache:
+    """In-memory LRU cache of responses, tagged with system versions.
+
+    An entry is only served while every system it covers still has the
+    version it had when the response was computed, and for at most `ttl`
+    seconds.  Versions are read *before* computing, so a market written
+    during the computation invalidates the entry rather than being missed.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, key, versions):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            (stored_at, stored_versions, value) = entry
+            if (
+                time.monotonic() - stored_at > self.ttl or
+                stored_versions != versions
+            ):
+                del self.entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, versions, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), versions, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+        }
+
+
+results = ResultCache(max_entries, ttl)
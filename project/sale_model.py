@@ -0,0 +1,139 @@
+import heapq
+
+import numpy as np
+
+
+def sale_revenue(price, demand, quantity, cap_demand=True, elasticity=0.0):
+    """Units sold and revenue from offering `quantity` to a market.
+
+    With `cap_demand` the market takes at most `demand` units.  With
+    `elasticity` the price falls linearly as demand fills, to
+    `(1 - elasticity) * price` for the last unit wanted.  Works elementwise
+    on arrays as well as on numbers.
+    """
+    sold = np.minimum(quantity, demand) if cap_demand else quantity
+    revenue = price * sold
+    if elasticity:
+        filled = np.divide(
+            np.minimum(sold, demand),
+            demand,
+            out=np.zeros(np.shape(demand)),
+            where=np.asarray(demand) > 0,
+        )
+        revenue = revenue * (1 - elasticity * filled / 2)
+    return (sold, revenue)
+
+
+def revenue_expression(
+    price,
+    demand,
+    quantity,
+    cap_demand=True,
+    elasticity=0.0,
+):
+    """`sale_revenue` as an aggregation expression."""
+    sold = {"$min": [quantity, demand]} if cap_demand else quantity
+    revenue = {"$multiply": [price, sold]}
+    if not elasticity:
+        return revenue
+    filled = {
+        "$cond": [
+            {"$gt": [demand, 0]},
+            {"$divide": [{"$min": [sold, demand]}, demand]},
+            0,
+        ],
+    }
+    return {
+        "$multiply": [
+            revenue,
+            {"$subtract": [1, {"$multiply": [elasticity / 2, filled]}]},
+        ],
+    }
+
+
+def split_sale(cargo, markets, hops=3, cap_demand=True, elasticity=0.0):
+    """Spread `cargo` over at most `hops` of `markets` for the most revenue.
+
+    Stations are picked greedily by the revenue they would add for the cargo
+    still unsold.  That can only shrink as stations are picked, so a lazy
+    heap only re-evaluates the current best.  The cargo is then allocated
+    over the picked stations, best price first for each commodity.
+
+    Returns (market index, {name: (sold, revenue)}) per stop, and what is
+    left unsold.
+    """
+    offers = [
+        {
+            c["name"]: (c["sellPrice"], c["demand"])
+            for c in market.get("commodities", [])
+            if c["name"] in cargo
+        }
+        for market in markets
+    ]
+
+    def value(i, remaining):
+        total = 0
+        for (name, (price, demand)) in offers[i].items():
+            if remaining.get(name):
+                (_, revenue) = sale_revenue(
+                    price,
+                    demand,
+                    remaining[name],
+                    cap_demand=cap_demand,
+                    elasticity=elasticity,
+                )
+                total += revenue
+        return total
+
+    def take(i, remaining):
+        for (name, (_, demand)) in offers[i].items():
+            if remaining.get(name):
+                if cap_demand:
+                    remaining[name] -= min(remaining[name], demand)
+                else:
+                    remaining[name] = 0
+
+    remaining = dict(cargo)
+    heap = [(-value(i, remaining), i) for i in range(len(markets))]
+    heapq.heapify(heap)
+    picked = []
+    while heap and len(picked) < hops and any(remaining.values()):
+        (_, i) = heapq.heappop(heap)
+        current = value(i, remaining)
+        if current <= 0:
+            continue
+        if heap and -current > heap[0][0]:
+            # Someone else might be better now
+            heapq.heappush(heap, (-current, i))
+            continue
+        picked.append(i)
+        take(i, remaining)
+
+    # Allocate each commodity over the picked stations, best price first
+    remaining = dict(cargo)
+    stops = {i: {} for i in picked}
+    for name in cargo:
+        bidders = sorted(
+            (i for i in picked if name in offers[i]),
+            key=lambda i: offers[i][name][0],
+            reverse=True,
+        )
+        for i in bidders:
+            if not remaining[name]:
+                break
+            (price, demand) = offers[i][name]
+            (sold, revenue) = sale_revenue(
+                price,
+                demand,
+                remaining[name],
+                cap_demand=cap_demand,
+                elasticity=elasticity,
+            )
+            if sold > 0:
+                stops[i][name] = (int(sold), int(round(revenue)))
+                remaining[name] -= int(sold)
+
+    return (
+        [(i, sales) for (i, sales) in stops.items() if sales],
+        {name: left for (name, left) in remaining.items() if left},
+    )
@@ -0,0 +1,63 @@
+import os
+
+import db
+
+
+# How long an EDSM sphere stays usable, in seconds
+ttl = float(os.environ.get("SPHERE_CACHE_TTL", 24 * 3600))
+
+
+class SphereCache:
+    """Radius-aware cache of EDSM sphere-systems results.
+
+    Spheres are stored per center system.  A cached sphere answers any query
+    around the same center with a radius no larger than its own, by
+    filtering on each system's `distance`.  Size limits, LRU eviction and
+    expiry are handled by the underlying diskcache.
+    """
+
+    def __init__(self, cache, ttl):
+        self.cache = cache
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, location):
+        return ("sphere", location.lower())
+
+    def get(self, location, radius):
+        entry = self.cache.get(self._key(location))
+        if entry is None or entry["radius"] < radius:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if entry["radius"] == radius:
+            return entry["systems"]
+        return [s for s in entry["systems"] if s["distance"] <= radius]
+
+    def set(self, location, radius, systems):
+        key = self._key(location)
+        current = self.cache.get(key)
+        if current is not None and current["radius"] > radius:
+            return
+        before = len(self.cache) + (0 if current is not None else 1)
+        self.cache.set(
+            key,
+            {"radius": radius, "systems": systems},
+            expire=self.ttl,
+        )
+        # Whatever didn't survive the set was culled to stay in size
+        self.evictions += max(0, before - len(self.cache))
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.cache),
+            "bytes": self.cache.volume(),
+        }
+
+
+spheres = SphereCache(db.edsm_cache, ttl)
@@ -1,25 +1,169 @@
 #!/usr/bin/env python
 
 
+import hashlib
 import json
 import re
 from datetime import datetime
 from pprint import pprint
 import time
 import os
-import subprocess
+import zlib
 
 from bs4 import BeautifulSoup
 from pymongo import MongoClient
+from pymongo import DESCENDING
+from pymongo import UpdateOne
 import requests
 
+import commodity_prices
+import result_cache
+from commodity_names import updated_marker as commodities_updated
 from conversion import from_edsm
+from dump_reader import Progress
+from dump_reader import read_dump
 import db
+import ingest_metrics
 
 
-def save_to_mongo(data):
-    print(f"{data=}")
+# Number of operations sent to each collection per bulk write
+batch_size = int(os.environ.get("DUMP_BATCH_SIZE", 1000))
+# Processes converting and writing entries; with one worker (the default)
+# the dump is loaded in this process, see parallel_dump.py
+workers = int(os.environ.get("DUMP_WORKERS", 1))
+writers = int(os.environ.get("DUMP_WRITERS", min(workers, 4)))
+
+
+def digest(converted):
+    """Fingerprint of everything we store for a station from the dump."""
+    serialized = json.dumps(converted, sort_keys=True, default=str)
+    hashed = hashlib.blake2b(serialized.encode("utf-8"), digest_size=16)
+    return hashed.hexdigest()
+
+
+def key_hash(key):
+    """Stable hash of a (system, station) key, the same in every process."""
+    joined = "\0".join(str(k) for k in key)
+    return zlib.crc32(joined.encode("utf-8"))
+
+
+def load_digests(shard=None):
+    """Stored digest of each station.
+
+    With `shard` as (index, shards), only stations whose `key_hash` is
+    `index` modulo `shards`, filtered by the server.
+    """
+    query = {"digest": {"$exists": True}}
+    if shard is not None:
+        (index, shards) = shard
+        query["key_hash"] = {"$mod": [shards, index]}
+    return {
+        (s["system"], s["station"]): s["digest"]
+        for s in db.station.find(
+            query,
+            {"_id": 0, "system": 1, "station": 1, "digest": 1},
+        )
+    }
+
+
+def save_digests(new_digests):
+    """Store digests of stations whose writes have all been applied.
+
+    Only once a station's market and prices are written may its digest be
+    stored, or a failed load would skip them as unchanged when resumed.
+    """
+    if new_digests:
+        db.station.bulk_write(
+            [
+                UpdateOne(
+                    {"system": system, "station": station},
+                    {
+                        "$set": {
+                            "digest": fingerprint,
+                            "key_hash": key_hash((system, station)),
+                        },
+                    },
+                )
+                for ((system, station), fingerprint) in new_digests.items()
+            ],
+            ordered=False,
+        )
+
+
+def eddn_markets():
+    """Markets the EDDN feed has written; the dump leaves them be."""
+    return {
+        (m["system"], m["station"])
+        for m in db.market.find(
+            {"source": "eddn"},
+            {"_id": 0, "system": 1, "station": 1},
+        )
+    }
+
+
+def known_commodity_names():
+    return {
+        c["name"]: c.get("readable")
+        for c in db.commodity.find({}, {"_id": 0, "name": 1, "readable": 1})
+    }
+
+
+def commodities_changed():
+    """Have the API reload its commodity name table."""
+    db.dump_meta.update_one(
+        commodities_updated,
+        {"$inc": {"version": 1}},
+        upsert=True,
+    )
+
+
+def save_to_mongo(
+    data,
+    writer,
+    commodity_names,
+    digests=None,
+    new_digests=None,
+    eddn_owned=frozenset(),
+):
+    """Queue the writes for one dump entry on `writer`.
+
+    `commodity_names` maps each commodity already stored or queued to its
+    readable name, so each commodity is only written when it is new or
+    renamed.
+
+    If `digests` is given, entries whose digest matches the one stored by a
+    previous load are skipped.  The digest of each entry written goes in
+    `new_digests`, to be stored with `save_digests` once the writes are
+    flushed.  Markets in `eddn_owned` and their prices aren't written.
+    Returns whether any writes were queued.
+    """
     converted = from_edsm(data)
+    fingerprint = digest(converted)
+    key = (converted["system"], converted["station"])
+    if digests is not None:
+        if digests.get(key) == fingerprint:
+            return False
+        digests[key] = fingerprint
+    if new_digests is not None:
+        new_digests[key] = fingerprint
+
+    for (collection, operation) in operations(
+        converted,
+        commodity_names,
+        market=key not in eddn_owned,
+    ):
+        writer.add(collection, operation)
+    return True
+
+
+def operations(converted, commodity_names, market=True):
+    """(collection, operation) for each write storing a converted entry.
+
+    Writes to db.commodity come first, and only for commodities missing
+    from `commodity_names`, which is updated to include them.  Writes to
+    db.commodity_prices come last.  If `market` is false, only the
+    commodities and the station are written.
+    """
     system = converted["system"]
     station = converted["station"]
     update_time = converted["update_time"]
@@ -27,53 +171,133 @@ def save_to_mongo(data):
     sc_distance = converted["sc_distance"]
     commodities = converted["commodities"]
     for commodity in commodities:
-        db.commodity.update_one(
-            {"name": commodity["name"]},
-            {
-                "$set": {
-                    "name": commodity["name"],
-                    "readable": commodity["readable"],
-                },
-            },
-            upsert=True,
-        )
         # We don't want this in the DB, EDDN does not have this key and we want
         # the DB entries to have identical fields
-        commodity.pop("readable")
-    db.station.update_one(
-        {
-            "system": system,
-            "station": station,
-        },
-        {
-            "$set": {
+        readable = commodity.pop("readable")
+        if commodity_names.get(commodity["name"]) == readable:
+            continue
+        commodity_names[commodity["name"]] = readable
+        yield (
+            db.commodity,
+            UpdateOne(
+                {"name": commodity["name"]},
+                {
+                    "$set": {
+                        "name": commodity["name"],
+                        "readable": readable,
+                    },
+                },
+                upsert=True,
+            ),
+        )
+    yield (
+        db.station,
+        UpdateOne(
+            {
                 "system": system,
                 "station": station,
-                "type": type_,
-                "sc_distance": sc_distance,
-                "source": "edsm-dump",
             },
-        },
-        upsert=True,
+            {
+                "$set": {
+                    "system": system,
+                    "station": station,
+                    "type": type_,
+                    "sc_distance": sc_distance,
+                    "source": "edsm-dump",
+                },
+            },
+            upsert=True,
+        ),
     )
-    db.market.update_one(
-        {
-            "system": system,
-            "station": station,
-            # EDDN data is fresher than the dump, we're constantly reading it
-            "source": {"$ne": "eddn"},
-        },
-        {
-            "$set": {
+    if not market:
+        return
+    yield (
+        db.market,
+        UpdateOne(
+            {
                 "system": system,
                 "station": station,
-                "update_time": update_time,
-                "commodities": commodities,
-                "source": "edsm-dump",
+                # EDDN data is fresher than the dump, we're constantly reading it
+                "source": {"$ne": "eddn"},
             },
-        },
-        upsert=True,
+            {
+                "$set": {
+                    "system": system,
+                    "station": station,
+                    "update_time": update_time,
+                    "commodities": commodities,
+                    "source": "edsm-dump",
+                },
+                # When we wrote it, which the market snapshot polls on
+                "$currentDate": {"written_at": True},
+            },
+            upsert=True,
+        ),
     )
+    for operation in commodity_prices.operations(
+        system,
+        station,
+        update_time,
+        commodities,
+        "edsm-dump",
+    ):
+        yield (db.commodity_prices, operation)
+
+
+def load_dump(entries, checkpoint=None):
+    """Save (offset, item) dump entries, as yielded by `read_dump`.
+
+    Every `batch_size` entries the writes are flushed and `checkpoint` is
+    called with the offset to resume from.  Returns how many stations were
+    changed and how many were skipped as unchanged.
+    """
+    writer = db.BulkWriter(batch_size=batch_size, label="edsm-dump")
+    known_names = known_commodity_names()
+    commodity_names = dict(known_names)
+    digests = load_digests()
+    new_digests = {}
+    eddn_owned = eddn_markets()
+    changed = 0
+    skipped = 0
+    # Systems whose cached /sales responses go stale once this batch lands
+    touched = set()
+    batch_started = time.monotonic()
+    for (i, (offset, item)) in enumerate(entries, 1):
+        if save_to_mongo(
+            item,
+            writer,
+            commodity_names,
+            digests=digests,
+            new_digests=new_digests,
+            eddn_owned=eddn_owned,
+        ):
+            changed += 1
+            touched.add(item.get("systemName"))
+            ingest_metrics.dump_entries.labels("changed").inc()
+        else:
+            skipped += 1
+            ingest_metrics.dump_entries.labels("skipped").inc()
+        if i % batch_size == 0:
+            writer.flush()
+            save_digests(new_digests)
+            new_digests = {}
+            now = time.monotonic()
+            ingest_metrics.dump_entries_per_second.set(
+                batch_size / max(now - batch_started, 1e-6),
+            )
+            ingest_metrics.dump_offset_bytes.set(offset)
+            batch_started = now
+            result_cache.bump(touched - {None})
+            touched = set()
+            if checkpoint:
+                checkpoint(offset)
+            print(f"Saved {i} stations ({offset} bytes, {skipped} unchanged)")
+    writer.flush()
+    save_digests(new_digests)
+    result_cache.bump(touched - {None})
+    if commodity_names != known_names:
+        commodities_changed()
+    return {"changed": changed, "skipped": skipped}
 
 
 def fetch_dump_page(url="https://www.edsm.net/en/nightly-dumps"):
@@ -83,10 +307,10 @@ def fetch_dump_page(url="https://www.edsm.net/en/nightly-dumps"):
     return soup
 
 
-def process_soup(soup):
+def process_soup(soup, title=r"Stations"):
     table = (
         soup
-            .find(class_="card-header", string=re.compile(r"Stations"))
+            .find(class_="card-header", string=re.compile(title))
             .find_parent(class_="card")
             .find("table")
     )
@@ -110,19 +334,24 @@ def process_soup(soup):
     return result
 
 
-def read_zipped_from_url(url):
-    cmd = (
-        f"curl '{url}' | "
-        f"zcat - | "
-        f"jq -nc --stream 'fromstream(1|truncate_stream(inputs))'"
+def _last_load_time():
+    last = db.dump_meta.find_one(
+        {"operation": "load"},
+        sort=[("loaded_at", DESCENDING)],
     )
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True)
-    for line in p.stdout:
-        json_ = json.loads(line)
-        yield json_
+    if last is None:
+        return 0
+    return last["loaded_at"].timestamp()
 
 
 def main():
+    progress = Progress()
+    ingest_metrics.dump_read_bytes.set_function(lambda: progress.read)
+    ingest_metrics.dump_size_bytes.set_function(lambda: progress.total or 0)
+    ingest_metrics.dump_progress_ratio.set_function(progress.ratio)
+    ingest_metrics.dump_last_load.set(_last_load_time())
+    ingest_metrics.serve(9102)
+
     while True:
         page = fetch_dump_page()
         meta = process_soup(page)
@@ -130,11 +359,55 @@ def main():
         prev_meta = db.dump_meta.find_one({"url": url}) or {"url": None, "updated": None}
         if prev_meta.get("updated") != meta["updated"]:
             print(f"{prev_meta.get('updated')=} != {meta['updated']=}, loading!")
-            for item in read_zipped_from_url(url):
-                save_to_mongo(item)
+
+            # Pick up where we left off if this dump was partially loaded
+            if prev_meta.get("loading") == meta["updated"]:
+                offset = prev_meta.get("offset", 0)
+                print(f"Resuming load from {offset=}")
+            else:
+                offset = 0
+
+            def checkpoint(offset):
+                db.dump_meta.update_one(
+                    {"url": url},
+                    {"$set": {"loading": meta["updated"], "offset": offset}},
+                    upsert=True,
+                )
+
+            if workers > 1:
+                import parallel_dump
+                counts = parallel_dump.load(
+                    url,
+                    offset=offset,
+                    checkpoint=checkpoint,
+                    progress=progress,
+                    workers=workers,
+                    writers=writers,
+                    lines=batch_size,
+                )
+            else:
+                counts = load_dump(
+                    read_dump(url, offset=offset, progress=progress),
+                    checkpoint=checkpoint,
+                )
+            print(f"Loaded {url}: {counts}")
+            ingest_metrics.dump_last_load.set_to_current_time()
+            db.dump_meta.insert_one(
+                {
+                    "operation": "load",
+                    "dump": url,
+                    "updated": meta["updated"],
+                    "resumed_from": offset,
+                    "loaded_at": datetime.now().astimezone(),
+                    **counts,
+                }
+            )
             db.dump_meta.update_one(
                 {"url": url},
-                {"$set": {"url": url, "updated": meta["updated"]}},
+                {
+                    "$set": {"url": url, "updated": meta["updated"]},
+                    "$unset": {"loading": "", "offset": ""},
+                },
                 upsert=True,
             )
             prev_meta = meta
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+
+import os
+import time
+
+from station_dump import fetch_dump_page
+from station_dump import process_soup
+from dump_reader import read_dump
+import db
+
+
+# Which dump to feed the coordinate index from.  The populated systems dump
+# covers every system with a real station market and is small enough to hold
+# in memory; point this at "Systems with coordinates" for the whole galaxy.
+dump_title = os.environ.get("SYSTEMS_DUMP_TITLE", r"[Pp]opulated systems")
+
+
+def save_to_mongo(data):
+    coords = data.get("coords")
+    if not coords:
+        return
+    db.systems.update_one(
+        {"name": data["name"]},
+        {
+            "$set": {
+                "name": data["name"],
+                "id64": data.get("id64"),
+                "coords": {
+                    "x": coords["x"],
+                    "y": coords["y"],
+                    "z": coords["z"],
+                },
+            },
+        },
+        upsert=True,
+    )
+
+
+def main():
+    while True:
+        page = fetch_dump_page()
+        meta = process_soup(page, title=dump_title)
+        url = meta["url"]
+        prev_meta = db.dump_meta.find_one({"url": url}) or {"url": None, "updated": None}
+        if prev_meta.get("updated") != meta["updated"]:
+            print(f"{prev_meta.get('updated')=} != {meta['updated']=}, loading!")
+            for (_, item) in read_dump(url):
+                save_to_mongo(item)
+            db.dump_meta.update_one(
+                {"url": url},
+                {"$set": {"url": url, "updated": meta["updated"]}},
+                upsert=True,
+            )
+        else:
+            print(f"No systems update found for {url}, no need to load.")
+        time.sleep(1800)
+
+
+if __name__ == "__main__":
+    main()
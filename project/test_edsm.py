@@ -0,0 +1,118 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from unittest import mock
+
+import edsm
+
+
+class StubEDSM(BaseHTTPRequestHandler):
+    """Answers with the (status, headers) queued in `responses`, in order.
+
+    Once only one is left it is repeated.
+    """
+
+    responses = []
+    requests = 0
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests += 1
+        if len(cls.responses) > 1:
+            (status, headers) = cls.responses.pop(0)
+        else:
+            (status, headers) = cls.responses[0]
+        body = json.dumps({"ok": status == 200}).encode("utf-8")
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, str(value))
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def limits(limit, remaining, reset):
+    return {
+        "X-Rate-Limit-Limit": limit,
+        "X-Rate-Limit-Remaining": remaining,
+        "X-Rate-Limit-Reset": reset,
+    }
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubEDSM)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/api"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubEDSM.requests = 0
+        self.waits = []
+        patches = [
+            mock.patch.object(edsm, "bucket", edsm.TokenBucket()),
+            # Record waits instead of sleeping through them; retrying also
+            # sleeps, for 0s, between attempts
+            mock.patch.object(edsm.time, "sleep", self.waits.append),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def get(self):
+        return edsm._get_with_http(self.url, {}).json()
+
+    def slept(self):
+        return [wait for wait in self.waits if wait]
+
+    def test_no_wait_while_tokens_remain(self):
+        StubEDSM.responses = [(200, limits(720, 700, 3600))]
+        for _ in range(5):
+            self.assertEqual(self.get(), {"ok": True})
+        self.assertEqual(self.slept(), [])
+
+    def test_waits_once_bucket_is_empty(self):
+        StubEDSM.responses = [(200, limits(720, 0, 60))]
+        self.get()
+        self.assertEqual(self.slept(), [])
+        self.get()
+        # 720 tokens refill over 60s, so the next one is 1/12s away
+        [wait] = self.slept()
+        self.assertAlmostEqual(wait, 60 / 720, delta=0.01)
+
+    def test_resyncs_from_headers(self):
+        StubEDSM.responses = [(200, limits(100, 40, 60))]
+        self.get()
+        bucket = edsm.bucket
+        self.assertEqual(bucket.capacity, 100)
+        self.assertAlmostEqual(bucket.tokens, 40, delta=0.1)
+        # The 60 missing tokens come back over the 60s until the reset
+        self.assertAlmostEqual(bucket.rate, 1.0)
+
+    def test_retries_after_429(self):
+        StubEDSM.responses = [
+            (429, {**limits(720, 0, 3600), "Retry-After": 2}),
+            (200, limits(720, 719, 3600)),
+        ]
+        self.assertEqual(self.get(), {"ok": True})
+        self.assertEqual(StubEDSM.requests, 2)
+        # The retry waited out Retry-After before going out
+        [wait] = self.slept()
+        self.assertGreaterEqual(wait, 2)
+        self.assertLess(wait, 2 + 3600 / 720 + 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import contextvars
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from prometheus_client import Counter as PromCounter
+from prometheus_client import Histogram
+from pymongo import monitoring
+
+
+stage_seconds = Histogram(
+    "sales_stage_seconds",
+    "Time spent in each stage of a /sales request",
+    ["stage"],
+    buckets=(
+        0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    ),
+)
+mongo_commands = PromCounter(
+    "mongo_commands",
+    "Commands sent to Mongo",
+    ["command"],
+)
+mongo_command_seconds = Histogram(
+    "mongo_command_seconds",
+    "Round-trip time of successful Mongo commands",
+    ["command"],
+)
+
+# Timings for the request being handled, if it asked for them.  Context
+# variables follow the request into threadpool calls and gathered tasks.
+_current = contextvars.ContextVar("timings", default=None)
+
+
+class Timings:
+    """Stage durations and Mongo command counts for one request."""
+
+    def __init__(self):
+        self.stages = Counter()
+        self.mongo = Counter()
+
+    def as_dict(self):
+        return {
+            "stages_ms": {
+                stage: round(seconds * 1000, 3)
+                for (stage, seconds) in self.stages.items()
+            },
+            "mongo_commands": dict(self.mongo),
+        }
+
+
+@contextmanager
+def collect():
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(stage):
+    """Time a stage, adding up repeated spans of the same stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.labels(stage).observe(elapsed)
+        timings = _current.get()
+        if timings is not None:
+            timings.stages[stage] += elapsed
+
+
+class MongoCommands(monitoring.CommandListener):
+    """Counts every Mongo command, per request when one is being timed."""
+
+    def started(self, event):
+        mongo_commands.labels(event.command_name).inc()
+        timings = _current.get()
+        if timings is not None:
+            timings.mongo[event.command_name] += 1
+
+    def succeeded(self, event):
+        mongo_command_seconds.labels(event.command_name).observe(
+            event.duration_micros / 1e6
+        )
+
+    def failed(self, event):
+        pass